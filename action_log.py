@@ -0,0 +1,139 @@
+"""Запись действий игрока в компактный двоичный лог и воспроизведение его на максимальной скорости.
+
+Формат: заголовок (магия RLOG, версия, seed подземелья, с версии 2 еще байт флагов), дальше по байту на ход:
+старшие 4 бита - код действия, затем по 2 бита на dx + 1 и dy + 1.
+Кроме seed подземелья и настроек из флагов (свое зрение у врагов меняет их решения) случайностей в игре нет,
+поэтому лог однозначно повторяет сессию.
+
+    python action_log.py session.rlog --repeat 5 --profile"""
+from __future__ import annotations
+
+import argparse
+import contextlib
+import os
+import struct
+import time
+from typing import BinaryIO, Iterator, List, Tuple
+
+from actions import Action, ActionWithDirection, BumpAction, EscapeAction, MeleeAction, MovementAction, WaitAction
+from engine import Engine
+from headless import GameResult, new_headless_engine
+import turn_profiler
+
+MAGIC = b"RLOG"
+VERSION = 2
+HEADER = struct.Struct("<4sBQ")  #  магия, версия, seed
+FLAGS = struct.Struct("<B")  #  с версии 2 сразу после HEADER
+FLAG_MONSTER_FOV = 1  #  игра шла с new_engine(monster_fov=True)
+
+#  коды действий; направленные действия хранят еще dx и dy
+CODES = {WaitAction: 0, BumpAction: 1, MovementAction: 2, MeleeAction: 3, EscapeAction: 4}
+ACTIONS = {code: cls for cls, code in CODES.items()}
+
+
+def encode(action: Action) -> int:
+    code = CODES.get(type(action))
+    if code is None:
+        raise ValueError(f"{type(action).__name__} cannot be recorded")
+    dx = dy = 0
+    if isinstance(action, ActionWithDirection):
+        dx, dy = action.dx, action.dy
+        if not (-1 <= dx <= 1 and -1 <= dy <= 1):
+            raise ValueError(f"direction ({dx}, {dy}) does not fit in the log")
+    return code << 4 | (dx + 1) << 2 | (dy + 1)
+
+
+def decode(byte: int, engine: Engine) -> Action:
+    cls = ACTIONS[byte >> 4]
+    if issubclass(cls, ActionWithDirection):
+        return cls(engine.player, ((byte >> 2) & 3) - 1, (byte & 3) - 1)
+    return cls(engine.player)
+
+
+class ActionRecorder:
+    """Пишет действия в поток. EventHandler вызывает record для каждого хода, байты копятся в буфере и сбрасываются в flush."""
+
+    def __init__(self, stream: BinaryIO, seed: int, buffer_size: int = 4096, monster_fov: bool = False):
+        self.stream = stream
+        self.seed = seed
+        self.buffer = bytearray()
+        self.buffer_size = buffer_size
+        self.count = 0
+        stream.write(HEADER.pack(MAGIC, VERSION, seed) + FLAGS.pack(FLAG_MONSTER_FOV if monster_fov else 0))
+
+    def record(self, action: Action) -> None:
+        self.buffer.append(encode(action))
+        self.count += 1
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self) -> None:
+        self.stream.write(self.buffer)
+        self.buffer.clear()
+        self.stream.flush()
+
+    def close(self) -> None:
+        self.flush()
+        self.stream.close()
+
+
+def read_log(stream: BinaryIO) -> Tuple[int, bool, bytes]:
+    """Возвращает (seed, monster_fov, байты действий). Логи версии 1 записаны без флагов, то есть без monster_fov."""
+    magic, version, seed = HEADER.unpack(stream.read(HEADER.size))
+    if magic != MAGIC:
+        raise ValueError("not an action log")
+    if version not in (1, VERSION):
+        raise ValueError(f"unsupported action log version {version}")
+    flags = FLAGS.unpack(stream.read(FLAGS.size))[0] if version >= 2 else 0
+    return seed, bool(flags & FLAG_MONSTER_FOV), stream.read()
+
+
+def iter_actions(data: bytes, engine: Engine) -> Iterator[Action]:
+    for byte in data:
+        yield decode(byte, engine)
+
+
+def replay(path: str, quiet: bool = True) -> GameResult:
+    """Проигрывает лог без отрисовки. Ход проходит через EventHandler.handle_action, как в игре; EscapeAction завершает прогон."""
+    with open(path, "rb") as stream:
+        seed, monster_fov, data = read_log(stream)
+    engine = new_headless_engine(seed, monster_fov)
+    handler = engine.event_handler
+    escape = CODES[EscapeAction]
+    turns = 0
+
+    with contextlib.ExitStack() as stack:
+        if quiet:
+            stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, "w"))))
+
+        start = time.perf_counter()
+        for byte in data:
+            if byte >> 4 == escape:
+                break
+            handler.handle_action(decode(byte, engine))
+            turns += 1
+        seconds = time.perf_counter() - start
+    engine.close()
+
+    return GameResult(seed, turns, seconds)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replay a recorded session headless and report turns per second.")
+    parser.add_argument("log")
+    parser.add_argument("--repeat", type=int, default=1, help="replay the log this many times")
+    parser.add_argument(
+        "--profile", metavar="PATH", nargs="?", const="", default=None,
+        help="profile turn phases, report to PATH (stderr if omitted) on exit",
+    )
+    args = parser.parse_args()
+    if args.profile is not None:
+        turn_profiler.profiler.enable(args.profile or None)
+
+    results: List[GameResult] = [replay(args.log) for _ in range(args.repeat)]
+    for result in results:
+        print(f"seed {result.seed}: {result.turns} turns in {result.seconds:.3f}s ({result.turns_per_second:.1f} turns/s)")
+
+
+if __name__ == "__main__":
+    main()
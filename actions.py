@@ -8,6 +8,8 @@ if TYPE_CHECKING:
 
 
 class Action:
+    __slots__ = ("entity",)
+
     def __init__(self, entity: Entity) -> None:
         super().__init__()
         self.entity = entity
@@ -21,16 +23,22 @@ class Action:
 
 
 class EscapeAction(Action):
+    __slots__ = ()
+
     def perform(self) -> None:
         raise SystemExit()
 
 
 class WaitAction(Action):
+    __slots__ = ()
+
     def perform(self) -> None:
         pass
 
 
 class ActionWithDirection(Action):
+    __slots__ = ("dx", "dy")
+
     def __init__(self, entity: Entity, dx: int, dy: int):
         super().__init__(entity)
 
@@ -49,6 +57,8 @@ class ActionWithDirection(Action):
         raise NotImplementedError()
 
 class MeleeAction(ActionWithDirection):
+    __slots__ = ()
+
     def perform(self) -> None:
         target = self.blocking_entity
         if not target:
@@ -58,6 +68,8 @@ class MeleeAction(ActionWithDirection):
 
 
 class MovementAction(ActionWithDirection):
+    __slots__ = ()
+
     def perform(self) -> None:
         dest_x, dest_y = self.dest_xy
 
@@ -66,7 +78,7 @@ class MovementAction(ActionWithDirection):
 
         if not self.engine.game_map.in_bounds(dest_x, dest_y):
             return # Destination is out of bounds.
-        if not self.engine.game_map.tiles["walkable"][dest_x, dest_y]:
+        if not self.engine.game_map.walkable[dest_x, dest_y]:
             return  # Destination is blocked by a tile.
         if self.engine.game_map.get_blocking_entity_at_location(dest_x, dest_y): #A проверяем не занят ли пункт назначения сущностью
             return
@@ -74,6 +86,8 @@ class MovementAction(ActionWithDirection):
         self.entity.move(self.dx,self.dy)
 
 class BumpAction(ActionWithDirection):                              #A этот класс принимает решение о том какой класс , между MeleeAction и MovementAction возвращать.
+    __slots__ = ()
+
     def perform(self) -> None:                                    #A  BumpAction просто определяет, какой из них подходит для вызова,
         if self.blocking_entity:
             return MeleeAction(self.entity, self.dx, self.dy).perform()
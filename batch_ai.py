@@ -0,0 +1,134 @@
+"""Пакетный ход HostileEnemy: решения всех врагов одного шага планировщика считаются массивами NumPy.
+
+Результат тот же, что у последовательных HostileEnemy.perform в порядке очереди:
+- видимый враг рядом с игроком бьет (MeleeAction);
+- видимый враг дальше шагает по общей карте расстояний FlowField (та же клетка, что выбрал бы FlowField.next_step);
+- невидимый враг и актеры с другим ИИ ходят как раньше, по одному, и разрезают пакет на отрезки.
+
+Ходы внутри отрезка применяются в порядке очереди: шаг удается, только если клетка свободна в момент хода,
+то есть с учетом тех, кто ушел или пришел раньше. Это считается без цикла по врагам (см. _resolve_moves)."""
+from __future__ import annotations
+
+from typing import List, TYPE_CHECKING
+
+import numpy
+
+from actions import MeleeAction
+from components.ai import HostileEnemy
+from flow_field import NEIGHBORS
+
+if TYPE_CHECKING:
+    from engine import Engine
+    from entity import Actor
+
+NEIGHBOR_DX = numpy.array([dx for dx, _ in NEIGHBORS])
+NEIGHBOR_DY = numpy.array([dy for _, dy in NEIGHBORS])
+UNREACHABLE = numpy.int64(numpy.iinfo(numpy.int64).max)  #  именно numpy.int64: простое int в numpy.where приводится к int32 поля и переполняется
+
+
+def perform_batch(engine: Engine, actors: List[Actor]) -> None:
+    """Выполняет ходы actors в их порядке; все они ходят в один и тот же момент времени планировщика."""
+    game_map = engine.game_map
+    player = engine.player
+    arrays = game_map.entity_arrays
+    slots = numpy.fromiter((arrays.slots[actor] for actor in actors), dtype=numpy.int64, count=len(actors))
+    xs, ys = arrays.x[slots].astype(numpy.int64), arrays.y[slots].astype(numpy.int64)
+    distance = numpy.maximum(abs(player.x - xs), abs(player.y - ys))
+    hostile = numpy.fromiter((type(actor.ai) is HostileEnemy for actor in actors), dtype=bool, count=len(actors))
+    batched = hostile & numpy.asarray(engine.sees_player(xs, ys), dtype=bool)  #  со своим зрением ФОВ всех врагов шага считается одним вызовом
+
+    start = 0
+    while start < len(actors):
+        if not batched[start]:
+            actor = actors[start]
+            if actor.ai:
+                actor.ai.perform()
+            start += 1
+            continue
+        stop = start
+        while stop < len(actors) and batched[stop]:
+            stop += 1
+        _perform_visible(engine, actors[start:stop], xs[start:stop], ys[start:stop], distance[start:stop])
+        start = stop
+
+
+def _perform_visible(engine: Engine, actors: List[Actor], xs: numpy.ndarray, ys: numpy.ndarray, distance: numpy.ndarray) -> None:
+    """Отрезок врагов, которые видят игрока. Никто из них еще не ходил в этом шаге, так что xs, ys актуальны."""
+    player = engine.player
+    for index in numpy.flatnonzero(distance <= 1).tolist():
+        actor = actors[index]
+        MeleeAction(actor, player.x - actor.x, player.y - actor.y).perform()
+
+    chasers = numpy.flatnonzero(distance > 1)
+    if chasers.size == 0:
+        return
+    for index in chasers.tolist():
+        ai = actors[index].ai
+        ai.path.clear()
+        ai.last_seen = (player.x, player.y)
+
+    flow_field = engine.flow_field
+    field = flow_field.distance if flow_field.distance is not None else flow_field.compute()
+    origin_x, origin_y = flow_field.origin
+    width, height = field.shape
+    local_x, local_y = xs[chasers] - origin_x, ys[chasers] - origin_y
+    inside = (local_x >= 0) & (local_x < width) & (local_y >= 0) & (local_y < height)
+
+    #  расстояния в 8 соседних клетках; за окном и вне карты - недостижимо
+    nx, ny = local_x[:, numpy.newaxis] + NEIGHBOR_DX, local_y[:, numpy.newaxis] + NEIGHBOR_DY
+    valid = inside[:, numpy.newaxis] & (nx >= 0) & (nx < width) & (ny >= 0) & (ny < height)
+    around = numpy.where(valid, field[nx.clip(0, width - 1), ny.clip(0, height - 1)], UNREACHABLE)
+    best = around.argmin(axis=1)  #  при равных расстояниях берется первый сосед в порядке NEIGHBORS, как в next_step
+    rows = numpy.arange(chasers.size)
+    own = numpy.where(inside, field[local_x.clip(0, width - 1), local_y.clip(0, height - 1)], 0)
+    stepping = inside & (around[rows, best] < own)
+
+    movers = chasers[stepping]
+    if movers.size == 0:
+        return
+    to_x = local_x[stepping] + NEIGHBOR_DX[best[stepping]]
+    to_y = local_y[stepping] + NEIGHBOR_DY[best[stepping]]
+
+    #  кто стоит на клетках окна до начала отрезка
+    arrays = engine.game_map.entity_arrays
+    blockers = numpy.flatnonzero(arrays.used & (arrays.layer != 0))
+    bx, by = arrays.x[blockers] - origin_x, arrays.y[blockers] - origin_y
+    in_window = (bx >= 0) & (bx < width) & (by >= 0) & (by < height)
+    occupied = numpy.zeros((width, height), dtype=bool)
+    occupied[bx[in_window], by[in_window]] = True
+
+    origins = local_x[stepping] * height + local_y[stepping]
+    targets = to_x * height + to_y
+    moved = _resolve_moves(origins, targets, occupied[to_x, to_y])
+
+    game_map = engine.game_map
+    for index, x, y in zip(movers[moved].tolist(), (to_x[moved] + origin_x).tolist(), (to_y[moved] + origin_y).tolist()):
+        game_map.move_entity(actors[index], x, y)
+
+
+def _resolve_moves(origins: numpy.ndarray, targets: numpy.ndarray, occupied: numpy.ndarray) -> numpy.ndarray:
+    """Какие из ходов origins[i] -> targets[i], сделанных по очереди, удадутся. occupied[i] - занята ли targets[i] до всех ходов.
+    Клетка занята в момент хода i, если последним событием на ней до i был приход удачного хода (а не уход),
+    а если событий не было - как в occupied. Результат хода зависит только от более ранних ходов, поэтому
+    простая итерация сходится к последовательному ответу не больше чем за len(targets) шагов, обычно за два-три."""
+    count = targets.size
+    order = numpy.arange(count)
+    queries = targets * (count + 1) + order
+    done = ~occupied
+    for _ in range(count + 1):
+        steps = numpy.flatnonzero(done)
+        if steps.size == 0:
+            return done
+        cells = numpy.concatenate([origins[steps], targets[steps]])
+        keys = cells * (count + 1) + numpy.concatenate([steps, steps])
+        arrived = numpy.concatenate([numpy.zeros(steps.size, dtype=bool), numpy.ones(steps.size, dtype=bool)])
+        sort = numpy.argsort(keys)
+        keys, cells, arrived = keys[sort], cells[sort], arrived[sort]
+
+        last = numpy.searchsorted(keys, queries) - 1  #  последнее событие раньше хода i, если оно на той же клетке
+        same_cell = (last >= 0) & (cells[last.clip(0)] == targets)
+        now_done = ~numpy.where(same_cell, arrived[last.clip(0)], occupied)
+        if numpy.array_equal(now_done, done):
+            break
+        done = now_done
+    return done
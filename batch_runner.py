@@ -0,0 +1,53 @@
+"""Пакетный прогон headless игр в пуле процессов.
+
+    python batch_runner.py --games 32 --turns 500 --workers 8
+
+Каждая игра получает свой seed (seed, seed + 1, ...), в конце печатается число ходов в секунду."""
+from __future__ import annotations
+
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import List
+
+from headless import GameResult, play_game
+
+
+def run_batch(games: int, turns: int, workers: int, seed: int = 0, render: bool = False) -> List[GameResult]:
+    play = partial(play_game, turns=turns, render=render)
+    seeds = range(seed, seed + games)
+    if workers <= 1:
+        return [play(s) for s in seeds]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(play, seeds))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Play many seeded headless games and report turns per second.")
+    parser.add_argument("--games", type=int, default=16)
+    parser.add_argument("--turns", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--render", action="store_true", help="render every turn into an off-screen console")
+    parser.add_argument("--verbose", action="store_true", help="print a line per game")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    results = run_batch(args.games, args.turns, args.workers, args.seed, args.render)
+    wall = time.perf_counter() - start
+
+    if args.verbose:
+        for result in results:
+            print(f"seed {result.seed}: {result.turns} turns in {result.seconds:.3f}s ({result.turns_per_second:.1f} turns/s)")
+
+    total_turns = sum(result.turns for result in results)
+    busy = sum(result.seconds for result in results)
+    print(f"{len(results)} games, {total_turns} turns, {args.workers} workers")
+    print(f"per process: {total_turns / busy:.1f} turns/s")
+    print(f"aggregate:   {total_turns / wall:.1f} turns/s (wall {wall:.2f}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+"""Воспроизводимые бенчмарки: генерация, ФОВ, ход врагов, отрисовка и поиск пути.
+
+    python benchmarks.py                      # полный прогон, сравнение с benchmarks_baseline.json
+    python benchmarks.py --quick              # только маленькие карты
+    python benchmarks.py --save-baseline      # записать текущие числа как базовые
+    python benchmarks.py --no-compare         # только замерить, без базовых чисел
+
+Каждый случай запускается с фиксированным seed на картах от 80x50 до 2000x2000 и с числом существ от 10 до 10000.
+Результаты пишутся в JSON; если какой-то случай стал медленнее базового больше чем на --tolerance,
+скрипт печатает регрессии и выходит с кодом 1. Без базового файла (и без --save-baseline или --no-compare) выход с ошибкой."""
+from __future__ import annotations
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy
+import tcod
+
+import entity_factories
+from engine import Engine
+from game_map import GameMap
+from roomGen import generate_dungeon
+
+MAP_SIZES = [(80, 50), (150, 80), (500, 500), (1000, 1000), (2000, 2000)]
+QUICK_MAP_SIZES = [(80, 50), (150, 80)]
+ENTITY_COUNTS = [10, 100, 1000, 10000]
+QUICK_ENTITY_COUNTS = [10, 100, 1000]
+
+MIN_SAMPLE_TIME = 0.01
+ENEMY_TURNS = 10  #  ходов врагов в одном замере handle_enemy_turns
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(HERE, "benchmarks_baseline.json")
+
+#  холодный старт: новый интерпретатор, импорты, тайлсет, первый уровень и первый кадр во внеэкранную консоль
+COLD_START = (
+    "import roguelike, tcod.console; "
+    "engine = roguelike.new_engine(0); roguelike.load_tileset(); "
+    "engine.render(tcod.console.Console(roguelike.SCREEN_WIDTH, roguelike.SCREEN_HEIGHT, order='F'))"
+)
+
+Timings = Dict[str, float]
+
+
+def measure(func: Callable[[], object], repeat: int) -> Timings:
+    """Время одного вызова в секундах. Быстрые функции вызываются пачкой (не меньше MIN_SAMPLE_TIME на замер), чтобы таймер не шумел."""
+    start = time.perf_counter()
+    func()
+    number = max(1, int(MIN_SAMPLE_TIME / max(time.perf_counter() - start, 1e-9)))
+
+    samples: List[float] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        samples.append((time.perf_counter() - start) / number)
+    return {"min": min(samples), "median": statistics.median(samples), "repeat": repeat, "number": number}
+
+
+def measure_fresh(setup: Callable[[], object], func: Callable[[object], object], number: int, repeat: int) -> Timings:
+    """Для функций, которые меняют свое состояние: каждый замер начинается с нового состояния setup() (вне таймера),
+    а func(state) вызывается на нем number раз подряд. Время - на один вызов."""
+    samples: List[float] = []
+    for _ in range(repeat):
+        state = setup()
+        start = time.perf_counter()
+        for _ in range(number):
+            func(state)
+        samples.append((time.perf_counter() - start) / number)
+    return {"min": min(samples), "median": statistics.median(samples), "repeat": repeat, "number": number}
+
+
+def max_rooms_for(width: int, height: int) -> int:  #  на 150x80 в игре 15 комнат, на больших картах попыток пропорционально больше
+    return max(15, width * height // 800)
+
+
+def build_dungeon(width: int, height: int, seed: int, monsters_per_room: int = 3) -> Engine:
+    engine = Engine(player=entity_factories.player.clone())
+    engine.game_map = generate_dungeon(
+        max_rooms=max_rooms_for(width, height),
+        room_min_size=15,
+        room_max_size=30,
+        MAP_WIDTH=width,
+        MAP_HEIGHT=height,
+        max_monsters_per_room=monsters_per_room,
+        engine=engine,
+        seed=seed,
+    )
+    return engine
+
+
+def populate(engine: Engine, count: int, seed: int) -> int:
+    """Расставляет count троллей на случайные свободные клетки пола. Возвращает, сколько реально поместилось."""
+    game_map = engine.game_map
+    floor = numpy.argwhere(game_map.walkable)
+    rng = numpy.random.default_rng(seed)
+    rng.shuffle(floor)
+    placed = 0
+    for x, y in floor.tolist():
+        if placed == count:
+            break
+        if game_map.get_entities_at_location(x, y):
+            continue
+        entity_factories.Troll.spawn(game_map, x, y)
+        placed += 1
+    return placed
+
+
+def far_floor_cell(game_map: GameMap, x: int, y: int) -> Tuple[int, int]:
+    floor = numpy.argwhere(game_map.walkable)
+    far = floor[numpy.argmax(numpy.abs(floor[:, 0] - x) + numpy.abs(floor[:, 1] - y))]
+    return int(far[0]), int(far[1])
+
+
+def run_suite(sizes: List[Tuple[int, int]], counts: List[int], seed: int, repeat: int, only: Optional[str]) -> Dict[str, Timings]:
+    results: Dict[str, Timings] = {}
+
+    def record_timings(name: str, timings: Callable[[], Timings]) -> None:
+        if only and only not in name:
+            return
+        results[name] = timings()
+        print(f"{name:<48} min {results[name]['min'] * 1000:10.3f} ms", file=sys.stderr)
+
+    def record(name: str, func: Callable[[], object], times: int = repeat) -> None:
+        record_timings(name, lambda: measure(func, times))
+
+    record("cold_start", lambda: subprocess.run([sys.executable, "-W", "ignore", "-c", COLD_START], cwd=HERE, check=True))
+
+    for width, height in sizes:
+        size = f"{width}x{height}"
+        record(f"generate_dungeon[{size}]", lambda: build_dungeon(width, height, seed), max(1, repeat // 2))
+
+        engine = build_dungeon(width, height, seed, monsters_per_room=0)
+        engine.update_fov()
+        record(f"update_fov[{size}]", lambda: (engine.invalidate_fov(), engine.update_fov()))  #  без кэша
+        record(f"update_fov_cached[{size}]", engine.update_fov)
+
+        for count in counts:
+            engine = build_dungeon(width, height, seed, monsters_per_room=0)
+            if populate(engine, count, seed) < count:
+                continue  #  столько существ на эту карту не влезает
+            engine.update_fov()
+            name = f"{size},n={count}"
+
+            console = tcod.console.Console(width, height, order="F")
+            game_map = engine.game_map
+            record(f"GameMap.render[{name}]", lambda: (game_map.mark_all_dirty(), game_map.render(console)))  #  полная перерисовка
+
+            player = engine.player
+            goal = far_floor_cell(engine.game_map, player.x, player.y)
+            record(f"BaseAI.get_path_to[{name}]", lambda: player.ai.get_path_to(*goal))
+
+            #  враги идут к игроку и засыпают, так что каждый замер - ENEMY_TURNS ходов с той же самой расстановки
+            def fresh() -> Engine:
+                engine = build_dungeon(width, height, seed, monsters_per_room=0)
+                populate(engine, count, seed)
+                engine.update_fov()
+                return engine
+
+            record_timings(f"handle_enemy_turns[{name}]", lambda: measure_fresh(fresh, Engine.handle_enemy_turns, ENEMY_TURNS, repeat))
+
+    return results
+
+
+def compare(results: Dict[str, Timings], baseline: Dict[str, Timings], tolerance: float) -> List[str]:
+    regressions = []
+    for name, timings in sorted(results.items()):
+        if name not in baseline:
+            continue
+        ratio = timings["min"] / baseline[name]["min"]  #  минимум меньше всего зависит от фоновой нагрузки
+        mark = ""
+        if ratio > 1 + tolerance:
+            mark = "  REGRESSION"
+            regressions.append(name)
+        print(f"{name:<48} {baseline[name]['min'] * 1000:10.3f} -> {timings['min'] * 1000:10.3f} ms ({ratio:5.2f}x){mark}")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Seeded benchmarks for generation, FOV, enemy turns, rendering and pathing.")
+    parser.add_argument("--quick", action="store_true", help="small maps and at most 1000 entities")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--filter", default=None, help="run only cases whose name contains this string")
+    parser.add_argument("--output", default=None, help="write results as JSON to this file")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the new baseline")
+    parser.add_argument("--no-compare", action="store_true", help="only measure (and --output), don't compare with the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown against the baseline, 0.25 = 25%%")
+    args = parser.parse_args()
+    #  базовые числа зависят от машины и в репозитории не лежат; без них сравнивать не с чем, и это ошибка, а не "нет регрессий"
+    if not (args.save_baseline or args.no_compare or os.path.exists(args.baseline)):
+        parser.error(f"no baseline at {args.baseline}: create one with --save-baseline or pass --no-compare")
+
+    sizes = QUICK_MAP_SIZES if args.quick else MAP_SIZES
+    counts = QUICK_ENTITY_COUNTS if args.quick else ENTITY_COUNTS
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):  #  MeleeAction печатает в stdout, а stdout оставляем для отчета
+        results = run_suite(sizes, counts, args.seed, args.repeat, args.filter)
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "numpy": numpy.__version__,
+            "tcod": tcod.__version__,
+            "machine": platform.machine(),
+            "seed": args.seed,
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.save_baseline:
+        baseline_report = {"meta": report["meta"], "results": dict(results)}
+        if os.path.exists(args.baseline):  #  при частичном прогоне (--quick, --filter) остальные базовые числа сохраняем
+            with open(args.baseline) as f:
+                baseline_report["results"] = {**json.load(f)["results"], **results}
+        with open(args.baseline, "w") as f:
+            json.dump(baseline_report, f, indent=2, sort_keys=True)
+        print(f"baseline saved to {args.baseline}")
+        return
+    if args.no_compare:
+        return
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)["results"]
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print(f"{len(regressions)} regression(s) over {args.tolerance:.0%}: " + ", ".join(regressions))
+        sys.exit(1)
+    print("no regressions")
+
+
+if __name__ == "__main__":
+    main()
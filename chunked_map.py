@@ -0,0 +1,368 @@
+"""Чанковое хранилище карты для очень больших миров.
+
+Карта режется на квадратные чанки CHUNK_SIZE x CHUNK_SIZE. Чанк создается (и генерируется) только когда к нему
+первый раз обращаются, редко используемые чанки выгружаются на диск, а видимость и исследованность хранятся по биту на клетку.
+ChunkedArray и BitPlane индексируются так же, как массивы NumPy в обычной GameMap ([x, y], [срез, срез], [массив, массив]),
+поэтому in_bounds, tiles[...] и render работают поверх них без изменений. В чанках лежат только номера плиток,
+а walkable и transparent - ленивые виды, которые переводят номера через таблицы реестра плиток при чтении."""
+from __future__ import annotations
+
+import os
+import shutil
+import tempfile
+import weakref
+from collections import OrderedDict
+from typing import Callable, Iterable, Iterator, Optional, Tuple, TYPE_CHECKING
+
+import numpy
+
+from game_map import GameMap
+import tile_types
+
+if TYPE_CHECKING:
+    from engine import Engine
+    from entity import Entity
+
+CHUNK_SIZE = 64
+
+ChunkGenerator = Callable[["ChunkedGameMap", int, int, numpy.ndarray], None]
+
+
+class ChunkStore:
+    """Чанки одного слоя карты. Держит в памяти не больше max_resident чанков (LRU), остальные сбрасывает в spill_dir.
+    Чанк, который совпадает со значением по умолчанию и не генерируется, просто выбрасывается."""
+
+    def __init__(
+        self,
+        name: str,
+        chunk_shape: Tuple[int, ...],
+        dtype: numpy.dtype,
+        fill: object,
+        generator: Optional[Callable[[int, int, numpy.ndarray], None]] = None,
+        max_resident: Optional[int] = None,
+        spill_dir: Optional[str] = None,
+    ):
+        self.name = name
+        self.chunk_shape = chunk_shape
+        self.dtype = numpy.dtype(dtype)
+        self.fill = fill
+        self.generator = generator
+        self.max_resident = max_resident
+        self.spill_dir = spill_dir
+        self.chunks: OrderedDict[Tuple[int, int], numpy.ndarray] = OrderedDict()
+        self.spilled: set = set()
+        self.generated = 0
+        self._remove_spill_dir: Optional[weakref.finalize] = None  #  только для каталога, который создал сам store
+
+    def chunk(self, cx: int, cy: int) -> numpy.ndarray:
+        key = (cx, cy)
+        array = self.chunks.get(key)
+        if array is not None:
+            self.chunks.move_to_end(key)
+            return array
+
+        if key in self.spilled:
+            path = self._path(key)
+            array = numpy.load(path)
+            self.spilled.discard(key)
+            os.remove(path)
+            self.chunks[key] = array
+        else:
+            array = numpy.full(self.chunk_shape, self.fill, dtype=self.dtype, order="F")
+            self.chunks[key] = array
+            if self.generator is not None:
+                self.generated += 1
+                self.generator(cx, cy, array)
+
+        self._evict()
+        return array
+
+    def _evict(self) -> None:
+        if self.max_resident is None:
+            return
+        while len(self.chunks) > self.max_resident:
+            key, array = self.chunks.popitem(last=False)  #  самый давно использованный чанк
+            if self.generator is None and (array == numpy.asarray(self.fill, dtype=self.dtype)).all():
+                continue  #  пустой чанк восстановится сам
+            if self.spill_dir is None:
+                self.spill_dir = tempfile.mkdtemp(prefix="roguelike-chunks-")
+                #  удаляется в close, а если его не позвали - когда store соберет сборщик мусора или при выходе
+                self._remove_spill_dir = weakref.finalize(self, shutil.rmtree, self.spill_dir, True)
+            numpy.save(self._path(key), array)
+            self.spilled.add(key)
+
+    def clear(self) -> None:  #  выбросить все чанки, в том числе выгруженные на диск
+        for key in self.spilled:
+            os.remove(self._path(key))
+        self.spilled.clear()
+        self.chunks.clear()
+
+    def close(self) -> None:
+        """Выбрасывает все чанки и удаляет временный каталог выгрузки, если его создал store. Чужой spill_dir остается."""
+        self.clear()
+        if self._remove_spill_dir is not None:
+            self._remove_spill_dir()
+            self._remove_spill_dir = None
+            self.spill_dir = None
+
+    def items(self) -> Iterator[Tuple[Tuple[int, int], numpy.ndarray]]:
+        """Все созданные чанки: сначала те, что в памяти, потом выгруженные. Порядок LRU при этом не меняется."""
+        yield from list(self.chunks.items())
+        for key in sorted(self.spilled):
+            yield key, numpy.load(self._path(key))
+
+    def _path(self, key: Tuple[int, int]) -> str:
+        return os.path.join(self.spill_dir, f"{self.name}_{key[0]}_{key[1]}.npy")
+
+    @property
+    def nbytes(self) -> int:  #  сколько занимают чанки, которые сейчас в памяти
+        return sum(array.nbytes for array in self.chunks.values())
+
+
+class _ChunkedGrid:
+    """Общая логика индексации: ключ раскладывается на куски по чанкам, а чтение и запись чанка делают наследники."""
+
+    def __init__(self, width: int, height: int, dtype: numpy.dtype):
+        self.width = width
+        self.height = height
+        self.shape = (width, height)
+        self.dtype = numpy.dtype(dtype)
+
+    def _read(self, cx: int, cy: int) -> numpy.ndarray:
+        raise NotImplementedError()
+
+    def _write(self, cx: int, cy: int, array: numpy.ndarray) -> None:
+        raise NotImplementedError()
+
+    def _get_cell(self, x: int, y: int) -> object:
+        return self._read(x // CHUNK_SIZE, y // CHUNK_SIZE)[x % CHUNK_SIZE, y % CHUNK_SIZE]
+
+    def _set_cell(self, x: int, y: int, value: object) -> None:
+        cx, cy = x // CHUNK_SIZE, y // CHUNK_SIZE
+        array = self._read(cx, cy)
+        array[x % CHUNK_SIZE, y % CHUNK_SIZE] = value
+        self._write(cx, cy, array)
+
+    def _parse(self, key: object) -> Tuple[object, object, Tuple[bool, bool]]:
+        if not isinstance(key, tuple):
+            key = (key, slice(None))
+        if len(key) != 2:
+            raise IndexError(f"expected two indices, got {key!r}")
+        kx, ky = key
+        squeeze = (isinstance(kx, (int, numpy.integer)), isinstance(ky, (int, numpy.integer)))
+        return kx, ky, squeeze
+
+    def _bounds(self, index: object, size: int) -> Tuple[int, int]:
+        if isinstance(index, (int, numpy.integer)):
+            index = int(index)
+            if index < 0:
+                index += size
+            if not 0 <= index < size:
+                raise IndexError(f"index {index} is out of bounds for size {size}")
+            return index, index + 1
+        start, stop, step = index.indices(size)
+        if step != 1:
+            raise IndexError("chunked maps only support slices with step 1")
+        return start, max(start, stop)
+
+    def _pieces(self, x1: int, x2: int, y1: int, y2: int) -> Iterator[Tuple[int, int, Tuple[slice, slice], Tuple[slice, slice]]]:
+        """Для прямоугольника [x1, x2) x [y1, y2) выдает (cx, cy, срез внутри чанка, срез внутри результата)."""
+        for cx in range(x1 // CHUNK_SIZE, (x2 - 1) // CHUNK_SIZE + 1):
+            left, right = max(x1, cx * CHUNK_SIZE), min(x2, (cx + 1) * CHUNK_SIZE)
+            for cy in range(y1 // CHUNK_SIZE, (y2 - 1) // CHUNK_SIZE + 1):
+                top, bottom = max(y1, cy * CHUNK_SIZE), min(y2, (cy + 1) * CHUNK_SIZE)
+                yield (
+                    cx,
+                    cy,
+                    (slice(left - cx * CHUNK_SIZE, right - cx * CHUNK_SIZE), slice(top - cy * CHUNK_SIZE, bottom - cy * CHUNK_SIZE)),
+                    (slice(left - x1, right - x1), slice(top - y1, bottom - y1)),
+                )
+
+    def _groups(self, xs: numpy.ndarray, ys: numpy.ndarray) -> Iterator[Tuple[int, int, numpy.ndarray]]:
+        """Разбивает точки (xs, ys) по чанкам: (cx, cy, индексы точек этого чанка)."""
+        chunk_x, chunk_y = xs // CHUNK_SIZE, ys // CHUNK_SIZE
+        order = numpy.lexsort((chunk_y, chunk_x))
+        keys = numpy.stack([chunk_x[order], chunk_y[order]], axis=1)
+        if keys.size == 0:
+            return
+        starts = numpy.flatnonzero(numpy.any(keys[1:] != keys[:-1], axis=1)) + 1
+        for group in numpy.split(order, starts):
+            yield int(chunk_x[group[0]]), int(chunk_y[group[0]]), group
+
+    def __getitem__(self, key: object) -> object:
+        kx, ky, squeeze = self._parse(key)
+        if squeeze == (True, True):
+            x, _ = self._bounds(kx, self.width)
+            y, _ = self._bounds(ky, self.height)
+            return self._get_cell(x, y)
+        if isinstance(kx, slice) or isinstance(ky, slice) or squeeze != (False, False):
+            x1, x2 = self._bounds(kx, self.width)
+            y1, y2 = self._bounds(ky, self.height)
+            out = numpy.empty((x2 - x1, y2 - y1), dtype=self.dtype, order="F")
+            for cx, cy, inner, outer in self._pieces(x1, x2, y1, y2):
+                out[outer] = self._read(cx, cy)[inner]
+            if squeeze[0]:
+                return out[0]
+            if squeeze[1]:
+                return out[:, 0]
+            return out
+
+        xs, ys = numpy.broadcast_arrays(numpy.asarray(kx, dtype=numpy.int64), numpy.asarray(ky, dtype=numpy.int64))
+        out = numpy.empty(xs.shape, dtype=self.dtype)
+        flat_x, flat_y, flat_out = xs.ravel(), ys.ravel(), out.reshape(-1)
+        for cx, cy, group in self._groups(flat_x, flat_y):
+            flat_out[group] = self._read(cx, cy)[flat_x[group] % CHUNK_SIZE, flat_y[group] % CHUNK_SIZE]
+        return out
+
+    def __setitem__(self, key: object, value: object) -> None:
+        kx, ky, squeeze = self._parse(key)
+        if squeeze == (True, True):
+            x, _ = self._bounds(kx, self.width)
+            y, _ = self._bounds(ky, self.height)
+            self._set_cell(x, y, value)
+            return
+        if isinstance(kx, slice) or isinstance(ky, slice) or squeeze != (False, False):
+            x1, x2 = self._bounds(kx, self.width)
+            y1, y2 = self._bounds(ky, self.height)
+            values = numpy.asarray(value, dtype=self.dtype)
+            if values.ndim:
+                if squeeze[0]:
+                    values = values[numpy.newaxis]
+                elif squeeze[1]:
+                    values = values[:, numpy.newaxis]
+                values = numpy.broadcast_to(values, (x2 - x1, y2 - y1))
+            for cx, cy, inner, outer in self._pieces(x1, x2, y1, y2):
+                array = self._read(cx, cy)
+                array[inner] = values[outer] if values.ndim else values
+                self._write(cx, cy, array)
+            return
+
+        xs, ys = numpy.broadcast_arrays(numpy.asarray(kx, dtype=numpy.int64), numpy.asarray(ky, dtype=numpy.int64))
+        flat_x, flat_y = xs.ravel(), ys.ravel()
+        values = numpy.asarray(value, dtype=self.dtype)
+        flat_values = numpy.broadcast_to(values, xs.shape).reshape(-1) if values.ndim else None
+        for cx, cy, group in self._groups(flat_x, flat_y):
+            array = self._read(cx, cy)
+            array[flat_x[group] % CHUNK_SIZE, flat_y[group] % CHUNK_SIZE] = values if flat_values is None else flat_values[group]
+            self._write(cx, cy, array)
+
+    def __array__(self, dtype: object = None, copy: object = None) -> numpy.ndarray:
+        #  целый слой пришлось бы сгенерировать и держать в памяти чанк за чанком, на огромном мире это ловушка
+        raise TypeError(f"{type(self).__name__} can't be converted as a whole, index a window like layer[x1:x2, y1:y2]")
+
+    def __len__(self) -> int:
+        return self.width
+
+
+class ChunkedArray(_ChunkedGrid):
+    """Массив номеров плиток по чанкам. С lookup это вид только для чтения: значение клетки - lookup[номер плитки]."""
+
+    def __init__(self, store: ChunkStore, width: int, height: int, lookup: Optional[numpy.ndarray] = None):
+        super().__init__(width, height, store.dtype if lookup is None else lookup.dtype)
+        self.store = store
+        self.lookup = lookup
+
+    def _read(self, cx: int, cy: int) -> numpy.ndarray:
+        chunk = self.store.chunk(cx, cy)
+        return chunk if self.lookup is None else self.lookup.take(chunk)
+
+    def _write(self, cx: int, cy: int, array: numpy.ndarray) -> None:
+        if self.lookup is not None:
+            raise TypeError("derived tile planes are read-only, change tiles with set_tiles")
+        #  _read отдает сам чанк, запись уже на месте
+
+
+class BitPlane(_ChunkedGrid):
+    """Булев слой (visible, explored), упакованный по биту на клетку: 512 байт на чанк 64x64."""
+
+    CHUNK_BYTES = CHUNK_SIZE * CHUNK_SIZE // 8
+
+    def __init__(self, name: str, width: int, height: int, max_resident: Optional[int] = None, spill_dir: Optional[str] = None):
+        super().__init__(width, height, numpy.dtype(bool))
+        self.store = ChunkStore(name, (self.CHUNK_BYTES,), numpy.uint8, 0, max_resident=max_resident, spill_dir=spill_dir)
+
+    def _read(self, cx: int, cy: int) -> numpy.ndarray:  #  индекс бита = x + y * CHUNK_SIZE, как в порядке "F"
+        bits = numpy.unpackbits(self.store.chunk(cx, cy))
+        return bits.view(bool).reshape((CHUNK_SIZE, CHUNK_SIZE), order="F")
+
+    def _write(self, cx: int, cy: int, array: numpy.ndarray) -> None:
+        self.store.chunk(cx, cy)[:] = numpy.packbits(array.ravel(order="F"))
+
+    def _get_cell(self, x: int, y: int) -> bool:
+        index = x % CHUNK_SIZE + (y % CHUNK_SIZE) * CHUNK_SIZE
+        return bool(self.store.chunk(x // CHUNK_SIZE, y // CHUNK_SIZE)[index >> 3] & (0x80 >> (index & 7)))
+
+    def _set_cell(self, x: int, y: int, value: object) -> None:
+        index = x % CHUNK_SIZE + (y % CHUNK_SIZE) * CHUNK_SIZE
+        packed = self.store.chunk(x // CHUNK_SIZE, y // CHUNK_SIZE)
+        if value:
+            packed[index >> 3] |= 0x80 >> (index & 7)
+        else:
+            packed[index >> 3] &= ~(0x80 >> (index & 7)) & 0xFF
+
+    def __ior__(self, other: object) -> BitPlane:  #  по той же причине, что и __array__; окно: plane[window] |= mask
+        raise TypeError("BitPlane can't be combined as a whole, use plane[x1:x2, y1:y2] |= mask")
+
+    @property
+    def nbytes(self) -> int:
+        return self.store.nbytes
+
+
+class ChunkedGameMap(GameMap):
+    """GameMap, у которой tiles, visible и explored лежат в чанках.
+    generator(game_map, cx, cy, tiles) вызывается один раз для каждого чанка при первом обращении к нему
+    и может как вырезать плитки, так и расставлять сущности."""
+
+    def __init__(
+        self,
+        engine: Engine,
+        width: int,
+        height: int,
+        entities: Iterable[Entity] = (),
+        generator: Optional[ChunkGenerator] = None,
+        max_resident_chunks: Optional[int] = None,
+        spill_dir: Optional[str] = None,
+    ):
+        self.generator = generator
+        self.max_resident_chunks = max_resident_chunks
+        self.spill_dir = spill_dir
+        self.save_path: Optional[str] = None  #  каталог сохранения, из которого еще не прочитанные чанки подгружаются (save_game.load)
+        super().__init__(engine, width, height, entities)
+
+    def _create_layers(self) -> None:
+        width, height = self.width, self.height
+        generator = self.generator
+        self.tiles = ChunkedArray(
+            ChunkStore(
+                "tiles",
+                (CHUNK_SIZE, CHUNK_SIZE),
+                tile_types.tile_id_dt,
+                tile_types.wall_id,
+                generator=(lambda cx, cy, chunk: generator(self, cx, cy, chunk)) if generator else None,
+                max_resident=self.max_resident_chunks,
+                spill_dir=self.spill_dir,
+            ),
+            width,
+            height,
+        )
+        self.walkable = ChunkedArray(self.tiles.store, width, height, tile_types.registry.walkable)
+        self.transparent = ChunkedArray(self.tiles.store, width, height, tile_types.registry.transparent)
+        self.visible = BitPlane("visible", width, height, self.max_resident_chunks, self.spill_dir)
+        self.explored = BitPlane("explored", width, height, self.max_resident_chunks, self.spill_dir)
+
+    def set_tiles(self, key: object, tile_ids: object) -> None:  #  walkable и transparent считаются из tiles при чтении
+        self.tiles[key] = tile_ids
+
+    def clear_visible(self) -> None:  #  без записи в каждый чанк: пустой слой - это слой без чанков
+        store = self.visible.store
+        store.clear()
+        store.generator = None  #  у загруженной карты генератор читает сохраненную видимость, она больше не нужна
+        self.mark_all_dirty()
+
+    def close(self) -> None:  #  выбросить чанки и временные каталоги выгрузки; после этого карта пуста
+        for store in (self.tiles.store, self.visible.store, self.explored.store):
+            store.close()
+
+    @property
+    def nbytes(self) -> int:  #  память под слои карты, которые сейчас загружены
+        return self.tiles.store.nbytes + self.visible.nbytes + self.explored.nbytes
@@ -0,0 +1,209 @@
+"""Монте-Карло баланс боя: миллионы поединков между наборами характеристик за один проход массивами NumPy.
+
+    python combat_sim.py Player Troll --fights 1000000
+    python combat_sim.py Player BigTroll --sweep power=3:8 defense=0:4
+    python combat_sim.py 30,2,5 16,1,4          характеристики как hp,defense,power
+
+Характеристики берутся из FighterStats прототипов entity_factories. Правила урона в самой игре пока нет
+(MeleeAction только печатает сообщение), поэтому здесь оно предварительное и живет только в этом модуле, см. damage:
+сила плюс бросок от 0 до DAMAGE_ROLL минус защита. Когда удар появится в игре, damage надо заменить на ее правило.
+Первый боец бьет, затем второй, если жив. Все поединки идут параллельно:
+цикл только по ходам, а внутри хода - массивы по всем еще не законченным боям."""
+from __future__ import annotations
+
+import argparse
+import itertools
+import time
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy
+
+import entity_factories
+from components.fighter import FighterStats
+
+DAMAGE_ROLL = 2   #  к силе удара добавляется случайное число от 0 до DAMAGE_ROLL включительно
+MAX_TURNS = 1000  #  если за столько ходов никто не умер (урон 0 с обеих сторон), это ничья
+BATCH = 1 << 21   #  поединков за один проход, чтобы сетка любого размера влезала в память
+
+sweep_dt = numpy.dtype(
+    [
+        ("hp", numpy.int32),
+        ("defense", numpy.int32),
+        ("power", numpy.int32),
+        ("win_rate", numpy.float64),
+        ("draw_rate", numpy.float64),
+        ("turns", numpy.float64),         #  средняя длина боя в ходах
+        ("damage_taken", numpy.float64),  #  средний урон, полученный первым бойцом
+    ]
+)
+
+
+def damage(power: numpy.ndarray, defense: numpy.ndarray, roll: numpy.ndarray) -> numpy.ndarray:
+    """Урон одного удара по массивам: сила плюс бросок минус защита, но не меньше нуля."""
+    return numpy.maximum(power + roll - defense, 0)
+
+
+class CombatResult(NamedTuple):
+    """Поединок за поединком: winner 1 - победил первый боец, -1 - второй, 0 - ничья."""
+    winner: numpy.ndarray
+    turns: numpy.ndarray
+    damage_to_a: numpy.ndarray
+    damage_to_b: numpy.ndarray
+
+    @property
+    def win_rate(self) -> float:
+        return float(numpy.mean(self.winner == 1))
+
+    @property
+    def draw_rate(self) -> float:
+        return float(numpy.mean(self.winner == 0))
+
+    def summary(self) -> str:
+        lines = [
+            f"{self.winner.size} fights: first wins {self.win_rate * 100:.2f}%, "
+            f"second wins {numpy.mean(self.winner == -1) * 100:.2f}%, draws {self.draw_rate * 100:.2f}%"
+        ]
+        for label, mask in (("first", self.winner == 1), ("second", self.winner == -1)):
+            if mask.any():
+                p50, p90, p99 = numpy.percentile(self.turns[mask], (50, 90, 99))
+                lines.append(f"turns to kill when {label} wins: mean {self.turns[mask].mean():.2f}, p50 {p50:.0f}, p90 {p90:.0f}, p99 {p99:.0f}")
+        for label, damage in (("first", self.damage_to_a), ("second", self.damage_to_b)):
+            counts = numpy.bincount(damage)
+            top = numpy.argsort(counts)[::-1][:5]
+            common = ", ".join(f"{value}: {counts[value] / damage.size * 100:.1f}%" for value in top.tolist() if counts[value])
+            lines.append(f"damage taken by {label}: mean {damage.mean():.2f}, max {damage.max()}; most common {common}")
+        return "\n".join(lines)
+
+
+def fight(
+    a_hp: numpy.ndarray, a_defense: numpy.ndarray, a_power: numpy.ndarray,
+    b_hp: numpy.ndarray, b_defense: numpy.ndarray, b_power: numpy.ndarray,
+    rng: numpy.random.Generator,
+    max_turns: int = MAX_TURNS,
+) -> CombatResult:
+    """Поединки по массивам характеристик: i-й бой - боец (a_hp[i], a_defense[i], a_power[i]) против бойца b."""
+    hp_a, hp_b = a_hp.astype(numpy.int32), b_hp.astype(numpy.int32)  #  копии, исходные нужны для подсчета урона
+    winner = numpy.zeros(hp_a.size, dtype=numpy.int8)
+    turns = numpy.full(hp_a.size, max_turns, dtype=numpy.int32)
+    active = numpy.arange(hp_a.size)
+
+    for turn in range(1, max_turns + 1):
+        if active.size == 0:
+            break
+        for attacker_power, defender_defense, defender_hp, side in ((a_power, b_defense, hp_b, 1), (b_power, a_defense, hp_a, -1)):
+            roll = rng.integers(0, DAMAGE_ROLL, size=active.size, endpoint=True, dtype=numpy.int32)
+            left = defender_hp[active] - damage(attacker_power[active], defender_defense[active], roll)
+            defender_hp[active] = left
+            dead = left <= 0
+            winner[active[dead]] = side
+            turns[active[dead]] = turn
+            active = active[~dead]
+
+    #  Fighter.hp не опускается ниже нуля, поэтому и урон не больше, чем было hp
+    damage_to_a = a_hp - numpy.maximum(hp_a, 0)
+    damage_to_b = b_hp - numpy.maximum(hp_b, 0)
+    return CombatResult(winner, turns, damage_to_a, damage_to_b)
+
+
+def simulate(a: FighterStats, b: FighterStats, fights: int, seed: Optional[int] = None, max_turns: int = MAX_TURNS) -> CombatResult:
+    rng = numpy.random.default_rng(seed)
+    results = []
+    for start in range(0, fights, BATCH):
+        count = min(BATCH, fights - start)
+        a_hp, a_defense, a_power = (numpy.full(count, value, dtype=numpy.int32) for value in a)
+        b_hp, b_defense, b_power = (numpy.full(count, value, dtype=numpy.int32) for value in b)
+        results.append(fight(a_hp, a_defense, a_power, b_hp, b_defense, b_power, rng, max_turns))
+    return CombatResult(*(numpy.concatenate(column) for column in zip(*results)))
+
+
+def sweep(
+    base: FighterStats,
+    opponent: FighterStats,
+    grid: Dict[str, Sequence[int]],
+    fights: int,
+    seed: Optional[int] = None,
+    max_turns: int = MAX_TURNS,
+) -> numpy.ndarray:
+    """Перебирает характеристики первого бойца по сетке grid (поле FighterStats -> значения), остальные берет из base.
+    Все точки сетки идут в одних и тех же массивах, по fights поединков на точку. Возвращает массив sweep_dt."""
+    names = FighterStats._fields
+    axes = [grid.get(name, [getattr(base, name)]) for name in names]
+    points = numpy.array(list(itertools.product(*axes)), dtype=numpy.int32).reshape(-1, len(names))
+    table = numpy.zeros(len(points), dtype=sweep_dt)
+    for index, name in enumerate(names):
+        table[name] = points[:, index]
+
+    rng = numpy.random.default_rng(seed)
+    per_batch = max(1, BATCH // fights)
+    for start in range(0, len(points), per_batch):
+        chunk = points[start:start + per_batch]
+        point = numpy.repeat(numpy.arange(len(chunk)), fights)
+        a_hp, a_defense, a_power = (chunk[point, index] for index in range(len(names)))
+        b_hp, b_defense, b_power = (numpy.full(point.size, value, dtype=numpy.int32) for value in opponent)
+        result = fight(a_hp, a_defense, a_power, b_hp, b_defense, b_power, rng, max_turns)
+
+        rows = table[start:start + len(chunk)]  #  срез - вид, запись идет прямо в table
+        rows["win_rate"] = numpy.bincount(point, weights=result.winner == 1, minlength=len(chunk)) / fights
+        rows["draw_rate"] = numpy.bincount(point, weights=result.winner == 0, minlength=len(chunk)) / fights
+        rows["turns"] = numpy.bincount(point, weights=result.turns, minlength=len(chunk)) / fights
+        rows["damage_taken"] = numpy.bincount(point, weights=result.damage_to_a, minlength=len(chunk)) / fights
+    return table
+
+
+def parse_fighter(text: str) -> Tuple[str, FighterStats]:
+    """Имя прототипа из entity_factories или hp,defense,power."""
+    if text in entity_factories.prototypes:
+        return text, entity_factories.prototypes[text].fighter.stats
+    try:
+        hp, defense, power = (int(value) for value in text.split(","))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected one of {list(entity_factories.prototypes)} or hp,defense,power, got {text!r}")
+    return text, FighterStats(hp, defense, power)
+
+
+def parse_range(text: str) -> Tuple[str, List[int]]:
+    """name=start:stop[:step], stop включительно."""
+    name, _, bounds = text.partition("=")
+    if name not in FighterStats._fields:
+        raise argparse.ArgumentTypeError(f"unknown stat {name!r}, expected one of {FighterStats._fields}")
+    try:
+        numbers = [int(value) for value in bounds.split(":")]
+        start, stop, step = (numbers + [1])[:3] if len(numbers) > 1 else (numbers[0], numbers[0], 1)
+    except (ValueError, IndexError):
+        raise argparse.ArgumentTypeError(f"expected {name}=start:stop[:step], got {text!r}")
+    return name, list(range(start, stop + 1, step))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Simulate many fights between two stat blocks with the game's combat rule.")
+    parser.add_argument("first", type=parse_fighter, help="prototype name or hp,defense,power; attacks first")
+    parser.add_argument("second", type=parse_fighter)
+    parser.add_argument("--fights", type=int, default=None,
+                        help="fights in total (default 1000000), or per grid point with --sweep (default 10000)")
+    parser.add_argument("--sweep", type=parse_range, nargs="+", metavar="STAT=START:STOP[:STEP]",
+                        help="vary the first fighter's stats over a grid")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--max-turns", type=int, default=MAX_TURNS)
+    args = parser.parse_args()
+    (first_name, first), (second_name, second) = args.first, args.second
+
+    start = time.perf_counter()
+    if args.sweep:
+        fights = args.fights or 10_000
+        table = sweep(first, second, dict(args.sweep), fights, args.seed, args.max_turns)
+        seconds = time.perf_counter() - start
+        print(f"{first_name} vs {second_name}: {len(table)} points x {fights} fights in {seconds:.2f}s")
+        print(f"{'hp':>4} {'def':>4} {'pow':>4} {'win %':>8} {'draw %':>8} {'turns':>7} {'dmg taken':>10}")
+        for row in table.tolist():
+            hp, defense, power, win_rate, draw_rate, turns, damage = row
+            print(f"{hp:>4} {defense:>4} {power:>4} {win_rate * 100:>8.2f} {draw_rate * 100:>8.2f} {turns:>7.2f} {damage:>10.2f}")
+        return
+
+    result = simulate(first, second, args.fights or 1_000_000, args.seed, args.max_turns)
+    seconds = time.perf_counter() - start
+    print(f"{first_name} {tuple(first)} vs {second_name} {tuple(second)} in {seconds:.2f}s")
+    print(result.summary())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,45 +1,79 @@
 from __future__ import annotations
 from html import entities
 
-from typing import List, Tuple, TYPE_CHECKING
-
-import numpy
-import tcod
+from collections import deque
+from itertools import islice
+from typing import Deque, List, Optional, Tuple, TYPE_CHECKING
 
 from actions import Action, MeleeAction, MovementAction, WaitAction
+from chunked_map import ChunkedGameMap
 from components.base_component import BaseComponent
 
 if TYPE_CHECKING:
     from entity import Actor
 
+PATH_MARGIN = 16  #  на сколько клеток окно поиска пути шире прямоугольника между началом и целью
+PATH_WINDOW_CELLS = 512 * 512  #  карты больше этого (и все чанковые) ищут путь сначала в окне, меньшие копируются целиком
+PATH_LOOKAHEAD = 3  #  сколько следующих шагов сохраненного пути проверяется на блокирующие сущности
+
 
 class BaseAI(Action, BaseComponent):
+    __slots__ = ()
+
     entity: Actor
 
     def perform(self) -> None:  #  BaseAI ?? ????????? perform ?????, ????????? ???????, ??????? ????? ???????????? AI ??? ????????, ?????? ????? ????? ????? AI,
         raise NotImplementedError()  #   ??????? ??????????? ?? ?????.
 
+    @property
+    def idle(self) -> bool:  #  True, если следующий ход точно будет ожиданием; такого актера планировщик усыпляет до события
+        return False
+
     def get_path_to(self, dest_x: int, dest_y: int) -> List[Tuple[int, int]]:  #get_path_to ?????????? ?????????? ?????? ?? ????? ????? ?????? ? ??????????
-        cost = numpy.array(self.entity.gamemap.tiles["walkable"], dtype=numpy.int8) #????????????? ?????? ???? TCOD, ????? ???????? ???? ?? ????????????? ??????? BaseAI
+        game_map = self.entity.gamemap
+        chunked = isinstance(game_map, ChunkedGameMap)
+        if chunked or game_map.width * game_map.height > PATH_WINDOW_CELLS:
+            #  Большую карту не копируем: ищем в прямоугольнике вокруг начала и цели с запасом PATH_MARGIN.
+            #  Путь в окне может не найтись или выйти длиннее; тогда обычная карта ищет по всей карте,
+            #  а чанковая нет - для нее это значило бы сгенерировать весь мир
+            x1 = max(0, min(self.entity.x, dest_x) - PATH_MARGIN)
+            y1 = max(0, min(self.entity.y, dest_y) - PATH_MARGIN)
+            x2 = min(game_map.width, max(self.entity.x, dest_x) + PATH_MARGIN + 1)
+            y2 = min(game_map.height, max(self.entity.y, dest_y) + PATH_MARGIN + 1)
+            path = self._path_in(x1, y1, x2, y2, dest_x, dest_y)
+            if path or chunked:
+                return path
+        return self._path_in(0, 0, game_map.width, game_map.height, dest_x, dest_y)
+
+    def _path_in(self, x1: int, y1: int, x2: int, y2: int, dest_x: int, dest_y: int) -> List[Tuple[int, int]]:  #  путь внутри прямоугольника [x1, x2) x [y1, y2)
+        cost = self.entity.gamemap.movement_cost(x1, y1, x2, y2) #????????????? ?????? ???? TCOD, ????? ???????? ???? ?? ????????????? ??????? BaseAI
                                                                                                                                                     #? ????? ??? ????.
-        for entity in self.entity.gamemap.entities:
-            if entity.blocks_movement and cost[entity.x, entity.y]:
-                cost[entity.x, entity.y] += 10
+
+        import tcod.path  #  tcod нужен только для поиска пути; генерация подземелья (roomGen) обходится без него
 
         graph = tcod.path.SimpleGraph(cost=cost, cardinal=2, diagonal=3)
         pathfinder = tcod.path.Pathfinder(graph)
 
-        pathfinder.add_root((self.entity.x, self.entity.y))  # ????????? ???????
+        pathfinder.add_root((self.entity.x - x1, self.entity.y - y1))  # ????????? ???????
 
-        path: List[List[int]] = pathfinder.path_to((dest_x, dest_y))[1:].tolist()   #  ????????? ???? ? ????? ?????????? ? ??????? ????????? ?????.
+        path: List[List[int]] = pathfinder.path_to((dest_x - x1, dest_y - y1))[1:].tolist()   #  ????????? ???? ? ????? ?????????? ? ??????? ????????? ?????.
 
-        return [(index[0], index[1]) for index in path]  # ?????????????? ?? ?????? [List[int]] ? ?????? [Tuple[int, int]]
+        return [(index[0] + x1, index[1] + y1) for index in path]  # ?????????????? ?? ?????? [List[int]] ? ?????? [Tuple[int, int]]
 
 
 class HostileEnemy(BaseAI):
+    __slots__ = ("path", "path_version", "last_seen")
+
     def __init__(self, entity: Actor):
         super().__init__(entity)
-        self.path: List[Tuple[int, int]] = []
+        self.path: Deque[Tuple[int, int]] = deque()  #  шаги снимаются с начала за O(1)
+        self.path_version = -1  #  tiles_version карты, на которой путь был построен
+        self.last_seen: Optional[Tuple[int, int]] = None  #  где враг в последний раз видел игрока
+
+    @property
+    def idle(self) -> bool:
+        #  Игрока не видно, пути нет и идти некуда: враг будет ждать, пока его клетка не окажется в ФОВе
+        return not self.path and self.last_seen is None and not self.engine.sees_player(self.entity.x, self.entity.y)
 
     def perform(self) -> None:
         target = self.engine.player
@@ -47,20 +81,61 @@ class HostileEnemy(BaseAI):
         dy = target.y - self.entity.y
         distance = max(abs(dx), abs(dy))
 
-        if self.engine.game_map.visible[self.entity.x, self.entity.y]:
+        if self.engine.sees_player(self.entity.x, self.entity.y):
             if distance <= 1:
                 return MeleeAction(self.entity, dx, dy).perform()
 
-            self.path = self.get_path_to(target.x, target.y)
+            #  Пока игрок на виду, шагаем по общей карте расстояний движка, а не ищем свой путь каждый ход
+            self.path.clear()
+            self.last_seen = (target.x, target.y)
+            step = self.engine.flow_field.next_step(self.entity.x, self.entity.y)
+            if step:
+                dest_x, dest_y = step
+                return MovementAction(
+                    self.entity, dest_x - self.entity.x, dest_y - self.entity.y,
+                ).perform()
+            return WaitAction(self.entity).perform()
+
+        if self.last_seen:  #  Игрок только что пропал из виду: идем туда, где его видели
+            self.follow(*self.last_seen)
+            self.last_seen = None
+        elif self.path:
+            self.follow(*self.path[-1])
 
         if self.path:
-            dest_x, dest_y = self.path.pop(0)
+            dest_x, dest_y = self.path.popleft()
             return MovementAction(
                 self.entity, dest_x - self.entity.x, dest_y - self.entity.y,
             ).perform()
 
         return WaitAction(self.entity).perform()
 
+    def path_valid(self, dest_x: int, dest_y: int) -> bool:
+        """Сохраненный путь годится, если ведет в (dest_x, dest_y), начинается рядом с врагом,
+        карта с тех пор не менялась и на ближайших шагах никто не стоит."""
+        path = self.path
+        if not path or path[-1] != (dest_x, dest_y):
+            return False
+        game_map = self.engine.game_map
+        if self.path_version != game_map.tiles_version:
+            return False
+        first_x, first_y = path[0]
+        if max(abs(first_x - self.entity.x), abs(first_y - self.entity.y)) > 1:
+            return False
+        for x, y in islice(path, PATH_LOOKAHEAD):
+            if game_map.get_blocking_entity_at_location(x, y):
+                return False
+        return True
+
+    def follow(self, dest_x: int, dest_y: int) -> None:  #  берет сохраненный путь, если он еще годится, иначе строит новый
+        stats = self.engine.path_stats
+        if self.path_valid(dest_x, dest_y):
+            stats.hits += 1
+            return
+        stats.misses += 1
+        self.path = deque(self.get_path_to(dest_x, dest_y))
+        self.path_version = self.engine.game_map.tiles_version
+
 ''' HostileEnemy ??? ????? ??, ??????? ?? ????? ???????????? ??? ????? ??????. ?? ?????????? perform ?????, ??????? ????????? ?????????:
 1) ???? ?????? ?? ????????? ? ???? ?????? ??????, ?????? ?????????.
 2) ???? ????? ????????? ????? ????? ? ???????? (distance <= 1), ???????? ??????.
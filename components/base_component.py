@@ -8,6 +8,8 @@ if TYPE_CHECKING:
 
 
 class BaseComponent:
+    __slots__ = ()  #  слот entity объявляют наследники: у BaseAI он уже есть в Action
+
     entity: Entity
 
     @property
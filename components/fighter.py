@@ -1,12 +1,40 @@
+from __future__ import annotations
+
+from typing import NamedTuple
+
 from components.base_component import BaseComponent
 
 
+class FighterStats(NamedTuple):  #  базовые характеристики вида, общие для всех его копий
+    hp: int
+    defense: int
+    power: int
+
+
 class Fighter(BaseComponent):
+    __slots__ = ("entity", "stats", "_hp")
+
     def __init__(self, hp: int, defense: int, power: int):  #  __init__ ??????? ????????? ????????? ??????????.
-        self.max_hp = hp  
+        self.stats = FighterStats(hp, defense, power)
         self._hp = hp                                       #  hp ???????????? ???? ????? ???????
-        self.defense = defense                              #  defense ??? ??, ????????? ?????????? ?????????? ????
-        self.power = power                                  #  power - ??? ???? ????? ???????
+
+    @property
+    def max_hp(self) -> int:
+        return self.stats.hp
+
+    @property
+    def defense(self) -> int:  #  defense и power по-прежнему читаются как атрибуты, но лежат в общем FighterStats
+        return self.stats.defense
+
+    @property
+    def power(self) -> int:
+        return self.stats.power
+
+    def clone(self) -> Fighter:
+        clone = object.__new__(Fighter)
+        clone.stats = self.stats
+        clone._hp = self._hp
+        return clone
 
     @property                                 
     def hp(self) -> int:               
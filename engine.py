@@ -1,15 +1,27 @@
 ﻿from __future__ import annotations
 
-from typing import TYPE_CHECKING
-from tcod.context import Context
-from tcod.console import Console
+from functools import partial
+from typing import Optional, Sequence, Tuple, TYPE_CHECKING, Union
+
+import numpy
 from tcod.map import compute_fov
 
+from batch_ai import perform_batch
+from flow_field import FlowField, PathStats
 from input_handlers import EventHandler
+import turn_profiler
 
 if TYPE_CHECKING:
+    from tcod.context import Context
+    from tcod.console import Console
+
     from entity import Entity
+    from fov_service import FovService
     from game_map import GameMap
+    from level_manager import LevelManager
+
+
+FOV_RADIUS = 20
 
 
 class Engine:
@@ -17,28 +29,100 @@ class Engine:
     def __init__(self, player: Entity):
         self.event_handler: EventHandler = EventHandler(self)
         self.player = player
-
+        self.flow_field = FlowField(self)  #A общая для всех врагов карта расстояний до игрока
+        self.path_stats = PathStats()  #A попадания и промахи кэша путей HostileEnemy
+        self.batch_ai = True  #A ходы врагов считаются пакетом (batch_ai); False - по одному, как раньше
+        self.profiler = turn_profiler.profiler  #A выключенный профайлер ничего не стоит, см. turn_profiler
+        self.fov_service: Optional[FovService] = None  #A если задан, у каждого врага свое зрение (см. sees_player)
+        self.level_manager: Optional[LevelManager] = None  #A LevelManager записывает себя сюда сам
+        #A кэш ФОВа: карта и позиция игрока, окно вокруг него и прозрачность в окне на момент расчета
+        self._fov_key: Optional[Tuple[GameMap, int, int]] = None
+        self._fov_window: Tuple[int, int, int, int] = (0, 0, 0, 0)
+        self._fov_transparent: Optional[numpy.ndarray] = None
 
     def handle_enemy_turns(self) -> None:
-        for entity in set(self.game_map.actors) - {self.player}:
-            if entity.ai:
-                entity.ai.perform()
+        self.flow_field.invalidate()  #A игрок мог сходить, карту расстояний надо посчитать заново
+        scheduler = self.game_map.scheduler
+        #A враги смотрят на ФОВ с конца прошлого хода, он же решает, кого из спящих пора будить
+        scheduler.wake_visible(self.game_map.visible, *self._fov_window)
+        if self.fov_service is not None:  #A со своим зрением враг дальше радиуса ФОВа игрока все равно ничего не видит
+            scheduler.wake_watching(self.sees_player, *self._fov_window)
+        scheduler.run_turn(partial(perform_batch, self) if self.batch_ai else None)
 
 
     def update_fov(self) -> None:   #A область видимости
-        self.game_map.visible[:] = compute_fov(
-            self.game_map.tiles["transparent"],
-            (self.player.x, self.player.y),
-            radius=20,
-        )
-        #A если плитка исследована то тогда она не будет в ШРАУДЕ
-        self.game_map.explored |= self.game_map.visible
-
-
-    def render(self, console: Console, context: Context) -> None:
-        self.game_map.render(console)
-        context.present(console)
-        console.clear()
+        """ФОВ считается только в окне FOV_RADIUS вокруг игрока: дальше радиуса он все равно ничего не видит.
+        Если игрок не сдвинулся и прозрачность в окне не поменялась (ожидание, удар в стену), берется прошлый результат."""
+        game_map = self.game_map
+        x, y = self.player.x, self.player.y
+        x1, y1 = max(0, x - FOV_RADIUS), max(0, y - FOV_RADIUS)
+        x2, y2 = min(game_map.width, x + FOV_RADIUS + 1), min(game_map.height, y + FOV_RADIUS + 1)
+        window = slice(x1, x2), slice(y1, y2)
+
+        transparent = game_map.transparent[window]  #A готовый слой прозрачности, копировать поле из структуры плиток больше не надо
+        key = (game_map, x, y)
+        if key == self._fov_key and numpy.array_equal(transparent, self._fov_transparent):
+            return
+
+        visible = compute_fov(transparent, (x - x1, y - y1), radius=FOV_RADIUS)
+
+        #A старое окно видимости надо погасить, новое - зажечь; обе операции делаем в одном охватывающем прямоугольнике
+        if self._fov_key is not None and self._fov_key[0] is game_map:
+            old_x1, old_y1, old_x2, old_y2 = self._fov_window
+        else:
+            #A после invalidate_fov или смены карты неизвестно, где горит старая видимость (загруженная, с прошлого визита), гасим всю
+            game_map.clear_visible()
+            old_x1, old_y1, old_x2, old_y2 = x1, y1, x2, y2
+        ux1, uy1, ux2, uy2 = min(x1, old_x1), min(y1, old_y1), max(x2, old_x2), max(y2, old_y2)
+        union = slice(ux1, ux2), slice(uy1, uy2)
+        new_visible = numpy.zeros((ux2 - ux1, uy2 - uy1), dtype=bool, order="F")
+        new_visible[x1 - ux1:x2 - ux1, y1 - uy1:y2 - uy1] = visible
+
+        changed = new_visible != game_map.visible[union]  #A перерисовывать надо только клетки, у которых поменялась видимость
+        columns = numpy.flatnonzero(changed.any(axis=1))
+        if columns.size:
+            rows = numpy.flatnonzero(changed.any(axis=0))
+            game_map.mark_dirty(ux1 + int(columns[0]), uy1 + int(rows[0]), ux1 + int(columns[-1]) + 1, uy1 + int(rows[-1]) + 1)
+        game_map.visible[union] = new_visible
+        #A если плитка исследована то тогда она не будет в ШРАУДЕ; меняться может только внутри окна
+        game_map.explored[window] |= visible
+
+        self._fov_key = key
+        self._fov_window = (x1, y1, x2, y2)
+        self._fov_transparent = numpy.array(transparent)
+
+    def invalidate_fov(self) -> None:  #A заставить следующий update_fov посчитать ФОВ заново; окно прошлого ФОВа при этом известно
+        self._fov_transparent = None
+
+    def reset_fov(self) -> None:  #A забыть и окно прошлого ФОВа: следующий update_fov погасит всю видимость карты
+        self._fov_key = None
+
+    def close(self) -> None:  #A освободить то, что игра держит помимо памяти: пул потоков fov_service и каталоги уровней
+        if self.fov_service is not None:
+            self.fov_service.shutdown()
+        if self.level_manager is not None:
+            self.level_manager.close()
+
+    def sees_player(self, xs: Union[int, Sequence[int]], ys: Union[int, Sequence[int]]) -> Union[bool, numpy.ndarray]:
+        """Видят ли игрока существа в клетках (xs, ys); числа или массивы, как у FovService.sees.
+        Без fov_service берется ФОВ самого игрока: кого видит он, тот видит его. С ним каждый смотрит своим ФОВом,
+        и спящих врагов handle_enemy_turns будит еще и по нему (TurnScheduler.wake_watching)."""
+        if self.fov_service is None:
+            return self.game_map.visible[xs, ys]
+        return self.fov_service.sees(self.game_map, xs, ys, self.player.x, self.player.y)
+
+
+    def render(self, console: Console, context: Optional[Context] = None) -> None:
+        if self.game_map.dirty is None:  #A ничего не поменялось - кадр пропускаем целиком, профайлер его даже не начинает
+            return
+        profiler = self.profiler
+        profiler.begin_frame()
+        with profiler.phase("render"):
+            self.game_map.render(console)
+        if context is not None:  #A в headless режиме рисуем только во внеэкранную консоль
+            with profiler.phase("present"):
+                context.present(console)  #A console.clear() больше не нужен: грязная область перерисовывается поверх старой
+        profiler.end_frame()
 
 
 '''Мы импортировали GameMap класс и теперь передаем его экземпляр в Engine инициализаторе класса. 
@@ -1,6 +1,5 @@
 from __future__ import annotations
-import copy
-from typing import Optional, Type, Tuple, TypeVar, TYPE_CHECKING
+from typing import NamedTuple, Optional, Type, Tuple, TypeVar, TYPE_CHECKING
 
 if TYPE_CHECKING:
     from components.ai import BaseAI
@@ -10,9 +9,18 @@ if TYPE_CHECKING:
 T = TypeVar("T", bound="Entity")
 
 
+class EntityKind(NamedTuple):
+    #A общие для всех сущностей одного вида неизменяемые данные; копии из spawn ссылаются на один и тот же объект
+    char: str
+    color: Tuple[int, int, int]
+    name: str
+    blocks_movement: bool
+
+
 class Entity:
-    gamemap: GameMap
+    __slots__ = ("x", "y", "kind", "gamemap")
 
+    gamemap: GameMap
 
     def __init__(
             self,
@@ -26,39 +34,71 @@ class Entity:
     ):
         self.x = x
         self.y = y
-        self.char = char
-        self.color = color
-        self.name = name
-        self.blocks_movement = blocks_movement  #A Blocks_movement описывает, можно ли переместить эту Сущность или нет.
+        self.kind = EntityKind(char, color, name, blocks_movement)  #A Blocks_movement описывает, можно ли переместить эту Сущность или нет.
         if gamemap:
             self.gamemap = gamemap
-            gamemap.entities.add(self)
+            gamemap.add_entity(self)
+
+    @property
+    def char(self) -> str:
+        return self.kind.char
+
+    @property
+    def color(self) -> Tuple[int, int, int]:
+        return self.kind.color
+
+    @property
+    def name(self) -> str:
+        return self.kind.name
+
+    @property
+    def blocks_movement(self) -> bool:
+        return self.kind.blocks_movement
+
+    def clone(self: T) -> T:
+        #A копия без карты: вид общий с оригиналом, а создается только состояние экземпляра (вместо copy.deepcopy)
+        clone = object.__new__(type(self))
+        clone.x = self.x
+        clone.y = self.y
+        clone.kind = self.kind
+        return clone
 
     def spawn(self: T, gamemap: GameMap, x: int, y: int) -> T:
         #A заспавнить копию экземпляра на этом же месте
-        clone = copy.deepcopy(self)
+        clone = self.clone()
         clone.x = x
         clone.y = y
         clone.gamemap = gamemap
-        gamemap.entities.add(clone)
+        gamemap.add_entity(clone)
         return clone
 
     def place(self, x: int, y: int, gamemap: Optional[GameMap] = None) -> None:
-        self.x = x
-        self.y = y
         if gamemap:
-            if hasattr(self, "gamemap"):
-                self.gamemap.entities.remove(self)
+            if hasattr(self, "gamemap") and self in self.gamemap.entities:
+                self.gamemap.remove_entity(self)  #A убираем из индекса старой карты, пока координаты еще старые
+            self.x = x
+            self.y = y
             self.gamemap = gamemap
-            gamemap.entities.add(self)
+            gamemap.add_entity(self)
+        else:
+            self._relocate(x, y)
 
 
     def move(self, dx: int, dy: int) -> None:
-        self.x += dx
-        self.y += dy
+        self._relocate(self.x + dx, self.y + dy)
+
+    def _relocate(self, x: int, y: int) -> None:
+        #A если сущность стоит на карте, то перемещаем ее через карту, чтобы обновился индекс клеток
+        if hasattr(self, "gamemap") and self in self.gamemap.entities:
+            self.gamemap.move_entity(self, x, y)
+        else:
+            self.x = x
+            self.y = y
 
 
 class Actor(Entity):
+    __slots__ = ("ai", "fighter", "speed")
+
     def __init__(
         self,
         *,
@@ -68,7 +108,8 @@ class Actor(Entity):
         color: Tuple[int, int, int] = (255, 255, 255),
         name: str = "<Unnamed>",
         ai_cls: Type[BaseAI],
-        fighter: Fighter
+        fighter: Fighter,
+        speed: int = 100,
     ):
         super().__init__(
             x = x,
@@ -83,6 +124,15 @@ class Actor(Entity):
 
         self.fighter = fighter
         self.fighter.entity = self
+        self.speed = speed  #A 100 - обычная скорость: один ход за ход игрока (см. scheduler)
+
+    def clone(self) -> Actor:
+        clone = super().clone()
+        clone.ai = type(self.ai)(clone) if self.ai else None  #A у копии свой ИИ с пустым состоянием (без пути и памяти об игроке)
+        clone.fighter = self.fighter.clone()
+        clone.fighter.entity = clone
+        clone.speed = self.speed
+        return clone
 
     @property
     def is_alive(self) -> bool:
@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+from typing import Dict, List, Optional, TYPE_CHECKING
+
+import numpy
+
+if TYPE_CHECKING:
+    from entity import Entity
+
+
+class EntityArrays:
+    """Параллельные массивы NumPy с позициями, символами и цветами сущностей карты.
+    Каждая сущность занимает свой слот; GameMap обновляет слоты при добавлении, удалении и перемещении,
+    а render рисует весь слой сущностей одной векторной операцией вместо console.print в цикле."""
+
+    def __init__(self, capacity: int = 64):
+        self.slots: Dict[Entity, int] = {}
+        self.entities: List[Optional[Entity]] = []  #  обратное отображение: слот -> сущность
+        self._free: List[int] = []
+        self._next_order = 0
+        self._size = 0  #  слоты [0, _size) уже выдавались хотя бы раз
+        self._allocate(capacity)
+
+    def _allocate(self, capacity: int) -> None:
+        old_size = self._size
+        grown = {
+            "x": numpy.zeros(capacity, dtype=numpy.int32),
+            "y": numpy.zeros(capacity, dtype=numpy.int32),
+            "ch": numpy.zeros(capacity, dtype=numpy.int32),
+            "fg": numpy.zeros((capacity, 3), dtype=numpy.uint8),
+            "layer": numpy.zeros(capacity, dtype=numpy.int8),   #  блокирующие сущности рисуются поверх остальных
+            "order": numpy.zeros(capacity, dtype=numpy.int64),  #  порядок добавления: среди равных сверху та, что добавлена позже
+            "used": numpy.zeros(capacity, dtype=bool),
+        }
+        for name, array in grown.items():
+            if old_size:
+                array[:old_size] = getattr(self, name)[:old_size]
+            setattr(self, name, array)
+        self.entities.extend([None] * (capacity - len(self.entities)))
+
+    def add(self, entity: Entity) -> None:
+        if self._free:
+            slot = self._free.pop()
+        else:
+            if self._size == len(self.used):
+                self._allocate(len(self.used) * 2)
+            slot = self._size
+            self._size += 1
+
+        self.slots[entity] = slot
+        self.entities[slot] = entity
+        self.x[slot] = entity.x
+        self.y[slot] = entity.y
+        self.ch[slot] = ord(entity.char)
+        self.fg[slot] = entity.color
+        self.layer[slot] = entity.blocks_movement
+        self.order[slot] = self._next_order
+        self.used[slot] = True
+        self._next_order += 1
+
+    def remove(self, entity: Entity) -> None:
+        slot = self.slots.pop(entity)
+        self.entities[slot] = None
+        self.used[slot] = False
+        self._free.append(slot)
+
+    def move(self, entity: Entity) -> None:
+        slot = self.slots[entity]
+        self.x[slot] = entity.x
+        self.y[slot] = entity.y
+
+    def slots_in(self, x1: int, y1: int, x2: int, y2: int) -> numpy.ndarray:
+        """Слоты всех сущностей внутри прямоугольника, в порядке слотов."""
+        size = self._size
+        x, y = self.x[:size], self.y[:size]
+        return numpy.flatnonzero(self.used[:size] & (x >= x1) & (x < x2) & (y >= y1) & (y < y2))
+
+    def slots_on_visible(self, visible: numpy.ndarray, x1: int, y1: int, x2: int, y2: int) -> numpy.ndarray:
+        """Слоты всех сущностей внутри прямоугольника, стоящих на видимых клетках, в порядке слотов."""
+        slots = self.slots_in(x1, y1, x2, y2)
+        return slots[visible[self.x[slots], self.y[slots]]]
+
+    def visible_slots(self, visible: numpy.ndarray, x1: int, y1: int, x2: int, y2: int) -> numpy.ndarray:
+        """Слоты сущностей внутри прямоугольника, стоящих на видимых клетках, в порядке отрисовки.
+        Если на клетке несколько сущностей, остается только та, что рисуется последней."""
+        slots = self.slots_on_visible(visible, x1, y1, x2, y2)
+        if slots.size == 0:
+            return slots
+
+        slots = slots[numpy.lexsort((self.order[slots], self.layer[slots]))]
+        cells = self.x[slots].astype(numpy.int64) * visible.shape[1] + self.y[slots]
+        _, last = numpy.unique(cells[::-1], return_index=True)  #  первый с конца = последний в порядке отрисовки
+        return slots[numpy.sort(slots.size - 1 - last)]
@@ -26,6 +26,8 @@ BigTroll = Actor(
     fighter=Fighter(hp=16, defense=1, power=4),
 )
 
+prototypes = {prototype.name: prototype for prototype in (player, Troll, BigTroll)}  # прототипы по имени: так уровень можно передать или сохранить как список (имя, x, y)
+
 ''' ?? ???????? ?????? ????????, ????? ???????????? Actor ?????, ? ???????????? HostileEnemy ????? AI ??? ????? Troll ? BigTroll.
  ????? ?? ?????????? ??, ??????? ??????????????? ??? ?? ?? ????? ????????, ????? ????, ??? ?? ?????? ???? ?????? ??? ???? Actor. 
  ????? ????, ?? ?????????? Fighter ????????? ??? ???????, ???????? ????????? ?????? ????????, ????? ??????? ??????? ??????? ??????? ??????? ???????. '''
\ No newline at end of file
@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+from typing import Optional, Tuple, TYPE_CHECKING
+
+import numpy
+import tcod
+
+if TYPE_CHECKING:
+    from engine import Engine
+    from game_map import GameMap
+
+#A соседние клетки в порядке проверки: сначала прямые шаги, потом диагональные,
+#A так при равных расстояниях выбор всегда одинаковый
+NEIGHBORS = (
+    (0, -1), (0, 1), (-1, 0), (1, 0),
+    (-1, -1), (1, -1), (-1, 1), (1, 1),
+)
+
+
+class PathStats:
+    """Счетчики кэша путей: hits - сколько раз взят готовый результат, misses - сколько раз пришлось искать заново."""
+
+    __slots__ = ("hits", "misses")
+
+    def __init__(self) -> None:
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __repr__(self) -> str:
+        return f"PathStats(hits={self.hits}, misses={self.misses}, hit_rate={self.hit_rate:.2f})"
+
+
+class FlowField:
+    """Одна карта расстояний (Dijkstra) с корнем в игроке, общая для всех HostileEnemy.
+    Считается не больше одного раза за ход врагов, а каждый враг просто смотрит на соседние клетки
+    и шагает туда, где расстояние до игрока меньше.
+    Карта считается только в окне RADIUS вокруг игрока: по ней ходят враги, которые видят игрока, а они все ближе радиуса ФОВ.
+    Если с прошлого расчета игрок не сдвинулся и стоимость клеток в окне та же (никто не ходил, карта не менялась),
+    Dijkstra не запускается, а берется прошлый результат."""
+
+    RADIUS = 32
+
+    def __init__(self, engine: Engine):
+        self.engine = engine
+        self.distance: Optional[numpy.ndarray] = None
+        self.origin = (0, 0)  #  координаты левого верхнего угла окна на карте
+        self.stats = PathStats()
+        self._key: Optional[Tuple[GameMap, int, int]] = None  #  карта и позиция игрока прошлого расчета
+        self._cost: Optional[numpy.ndarray] = None
+        self._distance: Optional[numpy.ndarray] = None
+
+    def invalidate(self) -> None:  #  Вызывается в начале хода врагов, чтобы карта пересчиталась под новое положение игрока
+        self.distance = None
+
+    def compute(self) -> numpy.ndarray:
+        game_map = self.engine.game_map
+        player = self.engine.player
+
+        x1, y1 = max(0, player.x - self.RADIUS), max(0, player.y - self.RADIUS)
+        x2, y2 = min(game_map.width, player.x + self.RADIUS + 1), min(game_map.height, player.y + self.RADIUS + 1)
+        cost = game_map.movement_cost(x1, y1, x2, y2)  #  Стоимость такая же, как в BaseAI.get_path_to
+
+        key = (game_map, player.x, player.y)
+        if key == self._key and numpy.array_equal(cost, self._cost):
+            self.stats.hits += 1
+            self.distance = self._distance
+            return self.distance
+        self.stats.misses += 1
+
+        graph = tcod.path.SimpleGraph(cost=cost, cardinal=2, diagonal=3)
+        pathfinder = tcod.path.Pathfinder(graph)
+        pathfinder.add_root((player.x - x1, player.y - y1))
+        pathfinder.resolve()
+
+        self.origin = (x1, y1)
+        self.distance = pathfinder.distance
+        self._key, self._cost, self._distance = key, cost, self.distance
+        return self.distance
+
+    def next_step(self, x: int, y: int) -> Optional[Tuple[int, int]]:
+        """Возвращает соседнюю клетку, которая ближе всего к игроку, или None, если ближе подойти нельзя."""
+        distance = self.distance if self.distance is not None else self.compute()
+        width, height = distance.shape
+        x -= self.origin[0]
+        y -= self.origin[1]
+        if not (0 <= x < width and 0 <= y < height):
+            return None
+
+        best: Optional[Tuple[int, int]] = None
+        best_distance = distance[x, y]
+        for dx, dy in NEIGHBORS:
+            nx, ny = x + dx, y + dy
+            if 0 <= nx < width and 0 <= ny < height and distance[nx, ny] < best_distance:
+                best, best_distance = (nx, ny), distance[nx, ny]
+
+        if best is None:
+            return None
+        return best[0] + self.origin[0], best[1] + self.origin[1]
@@ -0,0 +1,123 @@
+"""ФОВ для многих наблюдателей за один вызов: чтобы у каждого монстра было свое зрение.
+
+FovService считает ФОВ радиуса radius вокруг каждого наблюдателя в окне (2 * radius + 1)^2, как Engine.update_fov для игрока.
+Окна вырезаются из общего слоя прозрачности карты в главном потоке (у обычной карты это виды без копий),
+а сами compute_fov идут в пуле потоков: tcod считает ФОВ в C и на это время отпускает GIL.
+Результат хранится по клетке наблюдателя и годится, пока плитки карты не менялись (tiles_version)
+или пока прозрачность в его окне та же, что при расчете."""
+from __future__ import annotations
+
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, NamedTuple, Optional, Sequence, Tuple, TYPE_CHECKING, Union
+
+import numpy
+from tcod.map import compute_fov
+
+from flow_field import PathStats
+
+if TYPE_CHECKING:
+    from game_map import GameMap
+
+MIN_PARALLEL = 32  #  меньше наблюдателей дешевле посчитать прямо в вызывающем потоке
+
+
+class FovEntry(NamedTuple):
+    x1: int  #  левый верхний угол окна на карте
+    y1: int
+    visible: numpy.ndarray
+    transparent: numpy.ndarray  #  копия прозрачности окна на момент расчета
+    version: int  #  tiles_version, при которой окно последний раз проверено
+
+
+def _compute(jobs: Sequence[Tuple[numpy.ndarray, Tuple[int, int]]], radius: int) -> List[numpy.ndarray]:
+    return [compute_fov(transparent, origin, radius=radius) for transparent, origin in jobs]
+
+
+class FovService:
+    def __init__(self, radius: int = 20, workers: Optional[int] = None, max_cached: int = 1024):
+        self.radius = radius
+        self.workers = workers if workers is not None else os.cpu_count() or 1
+        self.max_cached = max_cached
+        self.cache: OrderedDict[Tuple[int, int], FovEntry] = OrderedDict()
+        self.stats = PathStats()  #  hits - ФОВ взят из кэша, misses - посчитан заново
+        self._game_map: Optional[GameMap] = None
+        self._pool: Optional[ThreadPoolExecutor] = None
+
+    def window(self, game_map: GameMap, x: int, y: int) -> Tuple[int, int, int, int]:
+        radius = self.radius
+        return max(0, x - radius), max(0, y - radius), min(game_map.width, x + radius + 1), min(game_map.height, y + radius + 1)
+
+    def _cached(self, game_map: GameMap, x: int, y: int) -> Optional[FovEntry]:
+        entry = self.cache.get((x, y))
+        if entry is None:
+            return None
+        if entry.version != game_map.tiles_version:
+            x1, y1, x2, y2 = self.window(game_map, x, y)
+            if not numpy.array_equal(game_map.transparent[x1:x2, y1:y2], entry.transparent):
+                return None
+            entry = entry._replace(version=game_map.tiles_version)  #  плитки менялись, но не рядом: результат годится дальше
+            self.cache[(x, y)] = entry
+        self.cache.move_to_end((x, y))
+        return entry
+
+    def visible_from(self, game_map: GameMap, xs: Sequence[int], ys: Sequence[int]) -> List[FovEntry]:
+        """ФОВ каждого наблюдателя (xs[i], ys[i]): окно и булев массив видимости в нем."""
+        if game_map is not self._game_map:
+            self.cache.clear()
+            self._game_map = game_map
+
+        xs, ys = numpy.asarray(xs).tolist(), numpy.asarray(ys).tolist()
+        entries: List[Optional[FovEntry]] = [None] * len(xs)
+        missing: List[int] = []
+        jobs = []
+        windows = []
+        for index, (x, y) in enumerate(zip(xs, ys)):
+            entry = self._cached(game_map, x, y)
+            if entry is not None:
+                entries[index] = entry
+                continue
+            x1, y1, x2, y2 = self.window(game_map, x, y)
+            transparent = game_map.transparent[x1:x2, y1:y2]  #  чанковая карта читается только здесь, пулу это не потокобезопасно
+            missing.append(index)
+            jobs.append((transparent, (x - x1, y - y1)))
+            windows.append((x1, y1))
+        self.stats.hits += len(xs) - len(missing)
+        self.stats.misses += len(missing)
+
+        for index, (x1, y1), (transparent, _), visible in zip(missing, windows, jobs, self._run(jobs)):
+            entry = FovEntry(x1, y1, visible, numpy.array(transparent), game_map.tiles_version)
+            entries[index] = entry
+            self.cache[(xs[index], ys[index])] = entry
+        while len(self.cache) > self.max_cached:
+            self.cache.popitem(last=False)
+        return entries
+
+    def _run(self, jobs: List[Tuple[numpy.ndarray, Tuple[int, int]]]) -> List[numpy.ndarray]:
+        if self.workers <= 1 or len(jobs) < MIN_PARALLEL:
+            return _compute(jobs, self.radius)
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="fov")
+        parts = [jobs[start::self.workers] for start in range(self.workers)]  #  поровну, а порядок восстановим ниже
+        results = list(self._pool.map(_compute, parts, [self.radius] * self.workers))
+        ordered: List[numpy.ndarray] = [None] * len(jobs)  # type: ignore[list-item]
+        for start, part in enumerate(results):
+            ordered[start::self.workers] = part
+        return ordered
+
+    def sees(self, game_map: GameMap, xs: Union[int, Sequence[int]], ys: Union[int, Sequence[int]], x: int, y: int) -> Union[bool, numpy.ndarray]:
+        """Видит ли каждый наблюдатель (xs[i], ys[i]) клетку (x, y). Для чисел возвращает bool, для массивов - булев массив.
+        ФОВ считается только тем, кто стоит не дальше radius: остальные все равно ничего не увидят."""
+        scalar = numpy.ndim(xs) == 0
+        xs, ys = numpy.atleast_1d(xs), numpy.atleast_1d(ys)
+        result = numpy.zeros(xs.shape, dtype=bool)
+        near = numpy.flatnonzero(numpy.maximum(abs(xs - x), abs(ys - y)) <= self.radius)
+        for index, entry in zip(near.tolist(), self.visible_from(game_map, xs[near], ys[near])):
+            result[index] = entry.visible[x - entry.x1, y - entry.y1]
+        return bool(result[0]) if scalar else result
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
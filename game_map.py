@@ -1,14 +1,17 @@
 ﻿from __future__ import annotations
 
-from typing import Iterable, Iterator, Optional, TYPE_CHECKING
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, TYPE_CHECKING
 
 import numpy
-from tcod.console import Console
 
 from entity import Actor
+from entity_arrays import EntityArrays
+from scheduler import TurnScheduler
 import tile_types
 
 if TYPE_CHECKING:
+    from tcod.console import Console
+
     from engine import Engine
     from entity import Entity
 
@@ -17,13 +20,30 @@ class GameMap:
     def __init__(self, engine: Engine, width: int, height: int, entities: Iterable[Entity] = ()):
         self.engine = engine
         self.width, self.height = width, height
-        self.entities = set(entities)
-        self.tiles = numpy.full((width, height), fill_value = tile_types.wall, order = "F") #  По сути, мы создаем 2D-массив, заполненный теми же значениями, 
-                                                                                        #  которые в данном случае являются tile_types.wall, 
-                                                                                        #  которые мы создали ранее. Это будет заполнено self.tiles плитками стен.
+        self.dirty: Optional[Tuple[int, int, int, int]] = (0, 0, width, height)  #A прямоугольник (x1, y1, x2, y2), который надо перерисовать; None - ничего не менялось
+        self.tiles_version = 0  #A растет при каждом изменении плиток после генерации; по нему ИИ понимает, что сохраненные пути устарели
+        self.entities: Dict[Entity, None] = {}  #A словарь вместо set: порядок добавления сохраняется, и игра с тем же seed идет так же
+        self._entities_at: Dict[Tuple[int, int], List[Entity]] = {}  #A индекс сущностей по клеткам, чтобы поиск по координатам был O(1)
+        self.entity_arrays = EntityArrays()  #A те же сущности в массивах NumPy для быстрой отрисовки
+        self.scheduler = TurnScheduler(self.entity_arrays)  #A очередь ходов врагов этой карты
+        for entity in entities:
+            entity.gamemap = self
+            self.add_entity(entity)
+        self._create_layers()
+
+    def _create_layers(self) -> None:  #A слои карты; ChunkedGameMap подменяет их на чанковые
+        width, height = self.width, self.height
+        self.tiles = numpy.full((width, height), fill_value = tile_types.wall_id, dtype = tile_types.tile_id_dt, order = "F") #  По сути, мы создаем 2D-массив, заполненный теми же значениями, 
+                                                                                        #  которые в данном случае являются tile_types.wall_id, 
+                                                                                        #  номером стены в реестре плиток. Это будет заполнено self.tiles плитками стен.
+        #A проходимость и прозрачность - отдельные плотные слои, их сразу берут поиск пути и ФОВ; менять их вместе с tiles через set_tiles
+        self.walkable, self.transparent = tile_types.registry.planes(self.tiles)
         self.visible = numpy.full((width, height), fill_value = False, order = "F") #A плитки которые игрок может увидеть
         self.explored = numpy.full((width,height), fill_value=False, order="F") #A плитки которые игрок видел раньше
 
+    @property
+    def nbytes(self) -> int:  #A память под слои карты; ChunkedGameMap считает только загруженные чанки
+        return sum(layer.nbytes for layer in (self.tiles, self.walkable, self.transparent, self.visible, self.explored))
 
     @property
     def actors(self) -> Iterator[Actor]:  #  Наше actors свойство вернет все Actor объекты на карте, но только те, которые в данный момент “живы”.
@@ -33,20 +53,53 @@ class GameMap:
             if isinstance(entity, Actor) and entity.is_alive
         )
 
-    def get_blocking_entity_at_location(self, location_x: int, location_y: int) -> Optional[Entity]: #A функция выполняет итерацию по всем существам
-        for entity in self.entities:                                                                #A если обнаружено что оба занимают заданные координаты
-            if (                                                                                    #А то она возвращает этот объект
-                entity.blocks_movement
-                and entity.x == location_x
-                and entity.y == location_y
-               ):      
+    def add_entity(self, entity: Entity) -> None:
+        if entity in self.entities:
+            return
+        self.entities[entity] = None
+        self._entities_at.setdefault((entity.x, entity.y), []).append(entity)
+        self.entity_arrays.add(entity)
+        if isinstance(entity, Actor) and entity.ai and entity is not self.engine.player:
+            self.scheduler.add(entity)
+        self.mark_dirty(entity.x, entity.y)
+
+    def remove_entity(self, entity: Entity) -> None:
+        del self.entities[entity]
+        self._unindex(entity)
+        self.entity_arrays.remove(entity)
+        if isinstance(entity, Actor):
+            self.scheduler.remove(entity)
+        self.mark_dirty(entity.x, entity.y)
+
+    def move_entity(self, entity: Entity, x: int, y: int) -> None:
+        #A переносим сущность в индексе: старая клетка -> новая клетка
+        self._unindex(entity)
+        self.mark_dirty(entity.x, entity.y)
+        entity.x, entity.y = x, y
+        self._entities_at.setdefault((x, y), []).append(entity)
+        self.entity_arrays.move(entity)
+        self.mark_dirty(x, y)
+
+    def _unindex(self, entity: Entity) -> None:
+        location = (entity.x, entity.y)
+        cell = self._entities_at[location]
+        cell.remove(entity)
+        if not cell:
+            del self._entities_at[location]
+
+    def get_entities_at_location(self, x: int, y: int) -> List[Entity]:
+        return self._entities_at.get((x, y), [])
+
+    def get_blocking_entity_at_location(self, location_x: int, location_y: int) -> Optional[Entity]: #A смотрим только сущности в заданной клетке,
+        for entity in self._entities_at.get((location_x, location_y), ()):                            #A а не перебираем всех существ на карте
+            if entity.blocks_movement:
                 return entity
         return None
 
     def get_actor_at_location(self, x: int, y: int) -> Optional[Actor]:  #  Мы также пошли дальше и добавили get_actor_at_location, который, как следует из названия,
-        for actor in self.actors:                                        #  действует аналогично get_blocking_entity_at_location, но возвращает только Actor.
-            if actor.x == x and actor.y == y:
-                return actor
+        for entity in self._entities_at.get((x, y), ()):                 #  действует аналогично get_blocking_entity_at_location, но возвращает только Actor.
+            if isinstance(entity, Actor) and entity.is_alive:
+                return entity
 
         return None
 
@@ -55,12 +108,65 @@ class GameMap:
         return 0 <= x < self.width and 0 <= y < self.height  #  если заданные значения x и y находятся в пределах границ карты. 
                                                              #  Мы можем использовать это, чтобы гарантировать, что игрок не выйдет за пределы карты, в пустоту.
 
-    def render(self, console: Console) -> None:                              #  Используя метод Console класса tiles_rgb, мы можем быстро отобразить всю карту.
-        console.tiles_rgb[0 : self.width, 0 : self.height] = numpy.select(   #  Этот метод оказывается намного быстрее, чем использование console.print метода,
-            condlist=[self.visible, self.explored],                          #  который мы используем для отдельных объектов.
-            choicelist=[self.tiles["light"], self.tiles["dark"]],
-            default=tile_types.SHROUD,               #A numpy.select позволяет нам условно рисовать нужные плитки на основе того, что указано в condlist.
-        )
-        for entity in self.entities: #A принтуем только те объекты которые в фове
-            if self.visible[entity.x, entity.y]:
-                console.print(x=entity.x, y=entity.y, string=entity.char, fg=entity.color)
+    def mark_dirty(self, x1: int, y1: int, x2: Optional[int] = None, y2: Optional[int] = None) -> None:
+        """Помечает клетку (x1, y1) или прямоугольник [x1, x2) x [y1, y2) для перерисовки.
+        Код, который меняет tiles после генерации, должен вызывать tiles_changed, который вызывает и этот метод."""
+        if x2 is None or y2 is None:
+            x2, y2 = x1 + 1, y1 + 1
+        if self.dirty is None:
+            self.dirty = (x1, y1, x2, y2)
+        else:
+            old_x1, old_y1, old_x2, old_y2 = self.dirty
+            self.dirty = (min(x1, old_x1), min(y1, old_y1), max(x2, old_x2), max(y2, old_y2))
+
+    def mark_all_dirty(self) -> None:
+        self.dirty = (0, 0, self.width, self.height)
+
+    def clear_visible(self) -> None:  #A погасить всю видимость, когда неизвестно, где ФОВ был в прошлый раз
+        self.visible[...] = False
+        self.mark_all_dirty()
+
+    def set_tiles(self, key: object, tile_ids: object) -> None:
+        """Записывает номера плиток по ключу (как у массива NumPy) и пересчитывает под ними walkable и transparent.
+        Писать прямо в tiles нельзя, слои отстанут. После генерации надо еще вызвать tiles_changed."""
+        self.tiles[key] = tile_ids
+        ids = self.tiles[key]
+        self.walkable[key] = tile_types.registry.walkable.take(ids)
+        self.transparent[key] = tile_types.registry.transparent.take(ids)
+
+    def tiles_changed(self, x1: int, y1: int, x2: Optional[int] = None, y2: Optional[int] = None) -> None:
+        """Сообщает, что плитки клетки или прямоугольника поменялись после генерации: перерисовать их и сбросить сохраненные пути."""
+        self.tiles_version += 1
+        self.mark_dirty(x1, y1, x2, y2)
+
+    def movement_cost(self, x1: int, y1: int, x2: int, y2: int) -> numpy.ndarray:
+        """Стоимость клеток прямоугольника [x1, x2) x [y1, y2) для поиска пути: 1 на проходимой плитке,
+        плюс 10 за каждую блокирующую сущность, чтобы враги обходили друг друга. 0 - стена."""
+        cost = numpy.array(self.walkable[x1:x2, y1:y2], dtype=numpy.int8)
+        arrays = self.entity_arrays
+        blockers = numpy.flatnonzero(arrays.used & (arrays.layer != 0))
+        xs, ys = arrays.x[blockers] - x1, arrays.y[blockers] - y1
+        inside = (xs >= 0) & (xs < x2 - x1) & (ys >= 0) & (ys < y2 - y1)
+        xs, ys = xs[inside], ys[inside]
+        numpy.add.at(cost, (xs, ys), 10 * (cost[xs, ys] != 0).astype(numpy.int8))
+        return cost
+
+    def render(self, console: Console) -> bool:                              #  Используя метод Console класса tiles_rgb, мы можем быстро отобразить карту.
+        """Перерисовывает только грязный прямоугольник. Возвращает False, если с прошлого раза ничего не поменялось."""
+        if self.dirty is None:
+            return False
+        x1, y1, x2, y2 = self.dirty
+        x2, y2 = min(x2, console.width), min(y2, console.height)  #A карта может быть больше консоли
+        region = slice(x1, x2), slice(y1, y2)
+        #A вырезаем только область: так чанковой карте не надо собирать весь мир.
+        #A Графика берется из таблиц реестра одним take по номерам плиток, это намного быстрее, чем console.print для каждой клетки
+        console.tiles_rgb[region] = tile_types.registry.render(self.tiles[region], self.visible[region], self.explored[region])
+        #A принтуем только те объекты которые в фове и в перерисованной области, все сразу через массивы
+        arrays = self.entity_arrays
+        slots = arrays.visible_slots(self.visible, x1, y1, x2, y2)
+        xs, ys = arrays.x[slots], arrays.y[slots]
+        console.ch[xs, ys] = arrays.ch[slots]
+        console.fg[xs, ys] = arrays.fg[slots]
+
+        self.dirty = None
+        return True
@@ -0,0 +1,92 @@
+"""Headless режим: игра без окна и без tcod.event.wait().
+Действия игрока берутся из скрипта или из функции-политики, а ход проходит тот же путь,
+что и в обычной игре (EventHandler.handle_action -> handle_enemy_turns -> update_fov)."""
+from __future__ import annotations
+
+import contextlib
+import itertools
+import os
+import random
+import time
+from typing import Callable, Iterable, NamedTuple, Optional, Tuple
+
+import tcod
+
+import roguelike
+from actions import Action, BumpAction, WaitAction
+from engine import Engine
+
+Policy = Callable[[Engine], Action]
+
+DIRECTIONS = ((0, -1), (0, 1), (-1, 0), (1, 0))
+
+
+class GameResult(NamedTuple):
+    seed: int
+    turns: int
+    seconds: float
+
+    @property
+    def turns_per_second(self) -> float:
+        return self.turns / self.seconds if self.seconds else 0.0
+
+
+def random_walk_policy(seed: int) -> Policy:  #  игрок ходит в случайную сторону, генератор свой, чтобы не сбивать random игры
+    rng = random.Random(seed)
+
+    def policy(engine: Engine) -> Action:
+        dx, dy = rng.choice(DIRECTIONS)
+        return BumpAction(engine.player, dx, dy)
+
+    return policy
+
+
+def script_policy(moves: Iterable[Tuple[int, int]]) -> Policy:  #  ходы по кругу из списка (dx, dy); (0, 0) значит ждать
+    steps = itertools.cycle(list(moves))
+
+    def policy(engine: Engine) -> Action:
+        dx, dy = next(steps)
+        if dx == 0 and dy == 0:
+            return WaitAction(engine.player)
+        return BumpAction(engine.player, dx, dy)
+
+    return policy
+
+
+def new_headless_engine(seed: int, monster_fov: bool = False) -> Engine:
+    return roguelike.new_engine(seed, monster_fov)  #  seed задает подземелье, а больше случайностей в ходе игры нет
+
+
+def play_game(
+    seed: int,
+    turns: int,
+    policy: Optional[Policy] = None,
+    render: bool = False,
+    quiet: bool = True,
+    record: Optional[str] = None,
+) -> GameResult:
+    """Играет одну игру на turns ходов. При render=True каждый ход рисуется во внеэкранную консоль,
+    при record ходы пишутся в лог действий (см. action_log), который потом можно проиграть заново."""
+    engine = new_headless_engine(seed)
+    if policy is None:
+        policy = random_walk_policy(seed)
+
+    console = tcod.console.Console(roguelike.SCREEN_WIDTH, roguelike.SCREEN_HEIGHT, order="F") if render else None
+    handler = engine.event_handler
+
+    with contextlib.ExitStack() as stack:
+        if quiet:  #  MeleeAction пишет в stdout, в нагрузочном прогоне это только мешает
+            stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, "w"))))
+        if record:
+            from action_log import ActionRecorder  #  action_log сам импортирует headless
+            handler.recorder = ActionRecorder(stack.enter_context(open(record, "wb")), seed)
+            stack.callback(handler.recorder.flush)
+
+        start = time.perf_counter()
+        for _ in range(turns):
+            handler.handle_action(policy(engine))
+            if console is not None:
+                engine.render(console)
+        seconds = time.perf_counter() - start
+
+    return GameResult(seed, turns, seconds)
@@ -1,32 +1,65 @@
 ﻿from __future__ import annotations
 from typing import Optional, TYPE_CHECKING
+import time
 
 import tcod.event
 
 from actions import Action, BumpAction, EscapeAction
 
 if TYPE_CHECKING:
+    from action_log import ActionRecorder
     from engine import Engine
 
+REPEAT_INTERVAL = 0.05  #A автоповтор зажатой клавиши дает не больше одного хода за столько секунд
 
 class EventHandler(tcod.event.EventDispatch[Action]):
     def __init__(self, engine: Engine):
         self.engine = engine
-
-    def handle_events(self) -> None:
-        for event in tcod.event.wait():
-            action = self.dispatch(event)
+        self.recorder: Optional[ActionRecorder] = None  #A если задан, каждый ход пишется в лог действий
+        self.repeat_interval = REPEAT_INTERVAL
+        self.dropped_repeats = 0  #A сколько повторов автоповтора пропущено
+        self._last_repeat = 0.0
+
+    def handle_events(self, timeout: Optional[float] = None) -> None:
+        """Обрабатывает все накопившиеся события. Ждет не дольше timeout секунд (None - пока что-нибудь не придет).
+        Повторы зажатой клавиши, пришедшие чаще repeat_interval, выбрасываются: иначе ходы копятся в очереди быстрее,
+        чем игра успевает их отрисовать, и отклик на отпускание клавиши растет."""
+        profiler = self.engine.profiler
+        for event in tcod.event.wait(timeout):
+            if isinstance(event, tcod.event.KeyDown) and event.repeat:
+                now = time.perf_counter()
+                if now - self._last_repeat < self.repeat_interval:
+                    self.dropped_repeats += 1
+                    continue
+                self._last_repeat = now
+            with profiler.phase("dispatch"):
+                action = self.dispatch(event)
 
             if action is None:
                 continue
 
+            self.handle_action(action)
+
+    def handle_action(self, action: Action) -> None:  #A один полный ход: действие игрока, ход врагов, ФОВ. Его же вызывает headless режим
+        if self.recorder is not None:
+            self.recorder.record(action)
+        profiler = self.engine.profiler
+        profiler.begin_turn()
+        with profiler.phase("perform"):
             action.perform()
 
+        with profiler.phase("enemy_turns"):
             self.engine.handle_enemy_turns()
+        with profiler.phase("fov"):
             self.engine.update_fov() #  Обновление нашего ФОВа перед следующим действием игрока
+        profiler.end_turn(len(self.engine.game_map.entities))
 
     def ev_quit(self, event: tcod.event.Quit) -> Optional[Action]:
         raise SystemExit()
+
+    def ev_windowexposed(self, event: tcod.event.WindowEvent) -> Optional[Action]:  #A окно надо показать заново, хотя игра не менялась
+        self.engine.game_map.mark_all_dirty()
+        return None
     
     def ev_keydown(self, event: tcod.event.KeyDown) -> Optional[Action]:
         action: Optional[Action] = None
@@ -0,0 +1,138 @@
+"""Несколько этажей подземелья в одной игре.
+
+LevelManager держит недавно посещенные уровни в памяти, пока их общий размер укладывается в бюджет байт.
+Давно не посещенные уровни сохраняются через save_game в каталог на диске и выбрасываются из памяти,
+а при возвращении загружаются обратно вместе с explored и сущностями, без новой генерации.
+Повторная выгрузка того же уровня дописывает в его каталог только изменения (см. save_game.save).
+
+Новые уровни строит функция generate(depth), например из заранее построенных в фоне:
+    pregen = LevelPregenerator(seed)
+    levels = LevelManager(engine, lambda depth: load_level(pregen.get(depth), engine))"""
+from __future__ import annotations
+
+import os
+import shutil
+import tempfile
+import weakref
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple, TYPE_CHECKING
+
+import save_game
+from chunked_map import ChunkedGameMap
+
+if TYPE_CHECKING:
+    from engine import Engine
+    from game_map import GameMap
+
+LevelGenerator = Callable[[int], "GameMap"]  #  строит новый уровень глубины depth и ставит на него engine.player
+
+ENTITY_BYTES = 1400  #  примерно столько памяти занимает одна сущность со всеми индексами карты (замерено tracemalloc)
+
+
+def level_nbytes(game_map: GameMap) -> int:
+    return game_map.nbytes + len(game_map.entities) * ENTITY_BYTES
+
+
+class LevelManager:
+    """Уровни по глубине: текущий, недавние в памяти (LRU) и выгруженные на диск.
+    Текущий уровень никогда не выгружается, даже если один не влезает в бюджет."""
+
+    def __init__(
+        self,
+        engine: Engine,
+        generate: LevelGenerator,
+        budget: int = 64 * 1024 * 1024,
+        spill_dir: Optional[str] = None,
+    ):
+        self.engine = engine
+        self.generate = generate
+        self.budget = budget
+        self.spill_dir = spill_dir
+        self.depth: Optional[int] = None
+        self.levels: OrderedDict[int, GameMap] = OrderedDict()  #  в памяти, от давно посещенных к недавним
+        self.spilled: Dict[int, str] = {}  #  глубина -> каталог сохранения
+        self.positions: Dict[int, Tuple[int, int]] = {}  #  где стоял игрок, когда ушел с уровня
+        self._chunked: Dict[int, Dict[str, Any]] = {}  #  как заново собрать чанковый уровень: исходный генератор чанков и лимит
+        self.generated = 0
+        self.restored = 0
+        self.evicted = 0
+        self._remove_spill_dir: Optional[weakref.finalize] = None  #  только для каталога, который создали здесь
+        engine.level_manager = self  #  Engine.close закрывает и уровни
+
+    @property
+    def nbytes(self) -> int:  #  сколько занимают уровни, которые сейчас в памяти
+        return sum(level_nbytes(game_map) for game_map in self.levels.values())
+
+    def enter(self, depth: int, position: Optional[Tuple[int, int]] = None) -> GameMap:
+        """Переводит игрока на уровень depth: в точку position, а если ее нет - туда, где он стоял на этом уровне
+        в прошлый раз (на новом уровне - на старт генератора). Возвращает карту, которая стала engine.game_map."""
+        player = self.engine.player
+        if self.depth is not None and depth != self.depth:
+            self.positions[self.depth] = (player.x, player.y)
+            self.engine.game_map.remove_entity(player)  #  генераторы ставят игрока в новую GameMap, не убирая его со старой
+
+        game_map = self._level(depth)
+        if position is None and player.gamemap is not game_map:
+            position = self.positions[depth]
+        if position is not None:
+            player.place(*position, game_map)  #  заодно убирает игрока со старой карты
+
+        self.depth = depth
+        self.engine.game_map = game_map
+        #  на уровне может гореть видимость с прошлого визита или из сохранения, а игрок уже в другой точке
+        self.engine.reset_fov()
+        self.engine.update_fov()
+        self._evict()
+        return game_map
+
+    def _level(self, depth: int) -> GameMap:
+        game_map = self.levels.get(depth)
+        if game_map is not None:
+            self.levels.move_to_end(depth)
+            return game_map
+
+        if depth in self.spilled:
+            game_map = save_game.load(self.spilled[depth], self.engine, **self._chunked.get(depth, {}))
+            self.restored += 1
+        else:
+            game_map = self.generate(depth)
+            self.generated += 1
+        self.levels[depth] = game_map
+        return game_map
+
+    def _evict(self) -> None:
+        while len(self.levels) > 1 and self.nbytes > self.budget:
+            depth = next(iter(self.levels))
+            if depth == self.depth:
+                self.levels.move_to_end(depth)
+                continue
+            self.spill(depth)
+
+    def spill(self, depth: int) -> None:
+        """Сохраняет уровень на диск и выбрасывает его из памяти. Текущий уровень выгружать нельзя."""
+        if depth == self.depth:
+            raise ValueError("can't spill the level the player is on")
+        game_map = self.levels.pop(depth)
+        if self.spill_dir is None:
+            self.spill_dir = tempfile.mkdtemp(prefix="roguelike-levels-")
+            self._remove_spill_dir = weakref.finalize(self, shutil.rmtree, self.spill_dir, True)  #  на случай, если close не позовут
+        path = self.spilled.get(depth) or os.path.join(self.spill_dir, f"level_{depth}")
+        save_game.save(game_map, path)
+        if isinstance(game_map, ChunkedGameMap) and depth not in self._chunked:  #  у загруженной карты генератор уже обертка над сохранением
+            self._chunked[depth] = {"generator": game_map.generator, "max_resident_chunks": game_map.max_resident_chunks}
+        if isinstance(game_map, ChunkedGameMap):
+            game_map.close()  #  все уже в сохранении, а выгруженные чанки иначе лежали бы во временном каталоге до выхода
+        self.spilled[depth] = path
+        self.evicted += 1
+
+    def close(self) -> None:
+        """Закрывает чанковые уровни в памяти и удаляет сохранения выгруженных уровней, если каталог создан здесь.
+        После close уровни больше не загрузить."""
+        for game_map in self.levels.values():
+            if isinstance(game_map, ChunkedGameMap):
+                game_map.close()
+        if self._remove_spill_dir is not None:
+            self._remove_spill_dir()
+            self._remove_spill_dir = None
+            self.spill_dir = None
+            self.spilled.clear()
@@ -0,0 +1,115 @@
+"""Фоновая генерация следующих уровней в пуле процессов.
+
+Уровень строится функцией build_level в виде LevelData: массив номеров плиток, старт игрока и список (имя прототипа, x, y).
+Та же функция вызывается и в пуле, и прямо в игре, поэтому уровень с одним seed всегда одинаковый, где бы его ни построили."""
+from __future__ import annotations
+
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy
+
+import entity_factories
+import roguelike
+from engine import Engine
+from game_map import GameMap
+from roomGen import generate_dungeon
+
+
+class LevelParams(NamedTuple):
+    width: int = roguelike.MAP_WIDTH
+    height: int = roguelike.MAP_HEIGHT
+    max_rooms: int = roguelike.max_rooms
+    room_min_size: int = roguelike.room_min_size
+    room_max_size: int = roguelike.room_max_size
+    max_monsters_per_room: int = roguelike.max_monsters_per_room
+
+
+class LevelData(NamedTuple):
+    seed: int
+    tiles: numpy.ndarray
+    player_start: Tuple[int, int]
+    entities: List[Tuple[str, int, int]]
+
+
+def build_level(seed: int, params: LevelParams = LevelParams()) -> LevelData:
+    """Строит уровень без настоящего движка: игрок здесь временный, нужен только чтобы узнать точку старта."""
+    engine = Engine(player=entity_factories.player.clone())
+    game_map = generate_dungeon(
+        max_rooms=params.max_rooms,
+        room_min_size=params.room_min_size,
+        room_max_size=params.room_max_size,
+        MAP_WIDTH=params.width,
+        MAP_HEIGHT=params.height,
+        max_monsters_per_room=params.max_monsters_per_room,
+        engine=engine,
+        seed=seed,
+    )
+    player = engine.player
+    entities = [(entity.name, entity.x, entity.y) for entity in game_map.entities if entity is not player]
+    return LevelData(seed, game_map.tiles, (player.x, player.y), entities)
+
+
+def load_level(level: LevelData, engine: Engine) -> GameMap:
+    """Собирает GameMap из готовых данных и ставит на нее игрока движка."""
+    width, height = level.tiles.shape
+    game_map = GameMap(engine, width, height, entities=[engine.player])
+    game_map.set_tiles(..., level.tiles)
+    engine.player.place(*level.player_start, game_map)
+    for name, x, y in level.entities:
+        entity_factories.prototypes[name].spawn(game_map, x, y)
+    return game_map
+
+
+def level_seed(base_seed: int, depth: int) -> int:  #  seed уровня зависит только от seed игры и глубины
+    return int(numpy.random.SeedSequence([base_seed, depth]).generate_state(1)[0])
+
+
+class LevelPregenerator:
+    """Держит в пуле процессов заказы на следующие lookahead уровней.
+    get(depth) отдает готовый уровень (или ждет его, или строит сам, если заказа не было) и заказывает следующие."""
+
+    def __init__(
+        self,
+        base_seed: int,
+        params: LevelParams = LevelParams(),
+        lookahead: int = 2,
+        executor: Optional[Executor] = None,
+    ):
+        self.base_seed = base_seed
+        self.params = params
+        self.lookahead = lookahead
+        self._own_executor = executor is None
+        self.executor = executor if executor is not None else ProcessPoolExecutor(max_workers=lookahead)
+        self.pending: Dict[int, Future] = {}
+
+    def prefetch(self, depth: int) -> None:
+        for next_depth in range(depth + 1, depth + 1 + self.lookahead):
+            if next_depth not in self.pending:
+                self.pending[next_depth] = self.executor.submit(build_level, level_seed(self.base_seed, next_depth), self.params)
+
+    def get(self, depth: int) -> LevelData:
+        future = self.pending.pop(depth, None)
+        if future is not None:
+            level = future.result()
+        else:
+            level = build_level(level_seed(self.base_seed, depth), self.params)
+        for stale in [d for d in self.pending if d < depth]:  #  уровни выше текущего больше не нужны
+            self.pending.pop(stale).cancel()
+        self.prefetch(depth)
+        return level
+
+    def shutdown(self) -> None:
+        for future in self.pending.values():
+            future.cancel()
+        self.pending.clear()
+        if self._own_executor:
+            #  заказы уже отменены, ждать осталось только уровни, которые строятся прямо сейчас; без ожидания
+            #  atexit пула может писать в уже закрытую трубу и падать с OSError при выходе
+            self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self) -> LevelPregenerator:
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        self.shutdown()
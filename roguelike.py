@@ -1,27 +1,47 @@
-﻿import copy
-import tcod
-from engine import Engine
-import entity_factories
-from roomGen import generate_dungeon
+﻿import time
+STARTED = time.perf_counter()  #A отсюда считается время до первого кадра: импорты ниже (tcod, numpy, движок) - большая часть холодного старта
 
+from concurrent.futures import ThreadPoolExecutor  # noqa: E402 - все импорты ниже идут после STARTED намеренно
+from typing import Optional  # noqa: E402
+import argparse  # noqa: E402
+import functools  # noqa: E402
+import random  # noqa: E402
 
-def main() -> None:
-    SCREEN_WIDTH = 150
-    SCREEN_HEIGHT = 80
+import tcod  # noqa: E402
+from engine import Engine, FOV_RADIUS  # noqa: E402
+from fov_service import FovService  # noqa: E402
+import turn_profiler  # noqa: E402
+import entity_factories  # noqa: E402
+from roomGen import generate_dungeon  # noqa: E402
+
+
+SCREEN_WIDTH = 150
+SCREEN_HEIGHT = 80
+
+MAP_WIDTH = 150
+MAP_HEIGHT = 80
+
+room_max_size = 30
+room_min_size = 15
+max_rooms = 15
+max_monsters_per_room = 3
+
+MAX_FPS = 60  #A чаще кадры не рисуются, сколько бы событий ни пришло
+
+TILESET_PATH = "arial12x12.png"
 
-    MAP_WIDTH = 150
-    MAP_HEIGHT = 80
 
-    room_max_size = 30
-    room_min_size = 15
-    max_rooms = 15
-    max_monsters_per_room = 3
+@functools.lru_cache(maxsize = None)
+def load_tileset() -> tcod.tileset.Tileset:  #A тайлсет грузится один раз на процесс и только когда действительно нужен
+    return tcod.tileset.load_tilesheet(TILESET_PATH, 32, 8, tcod.tileset.CHARMAP_TCOD)
 
-    tileset = tcod.tileset.load_tilesheet("arial12x12.png", 32, 8, tcod.tileset.CHARMAP_TCOD)
 
-    player = copy.deepcopy(entity_factories.player)
-    
+def new_engine(seed: Optional[int] = None, monster_fov: bool = False) -> Engine:  #A создание новой игры вынесено из main, чтобы его могли вызывать headless режим и бенчмарки
+    player = entity_factories.player.clone()
+
     engine = Engine(player = player)
+    if monster_fov:  #A у каждого врага свое зрение; пул потоков сервиса закрывает engine.close()
+        engine.fov_service = FovService(radius = FOV_RADIUS)
 
     engine.game_map = generate_dungeon(
         max_rooms = max_rooms,
@@ -31,21 +51,67 @@ def main() -> None:
         MAP_HEIGHT = MAP_HEIGHT,
         max_monsters_per_room=max_monsters_per_room,
         engine = engine,
+        seed = seed,
     )
     engine.update_fov()
+    return engine
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description = "Test game")
+    parser.add_argument("--seed", type = int, default = None, help = "dungeon seed (random by default)")
+    parser.add_argument("--record", metavar = "PATH", default = None, help = "write every action to a replayable log")
+    parser.add_argument("--profile", metavar = "PATH", nargs = "?", const = "", default = None,
+                        help = "profile turns and frames, report to PATH (stderr if omitted) on exit")
+    parser.add_argument("--monster-fov", action = "store_true", help = "give every monster its own field of view (see fov_service)")
+    args = parser.parse_args()
+    if args.profile is not None:
+        turn_profiler.profiler.enable(args.profile or None)
+
+    seed = args.seed if args.seed is not None else random.randrange(2 ** 32)  #A seed нужен явный, чтобы запись можно было повторить
+    seed %= 2 ** 64  #A любой --seed, в том числе отрицательный: генератор подземелья берет только неотрицательные, а лог хранит 64 бита
+
+    #A первый уровень генерируется в фоне, пока грузится тайлсет и создается окно
+    pool = ThreadPoolExecutor(max_workers = 1)
+    engine_future = pool.submit(new_engine, seed, args.monster_fov)
+    pool.shutdown(wait = False)
 
     with tcod.context.new_terminal(
         SCREEN_WIDTH,
         SCREEN_HEIGHT,
-        tileset = tileset,
+        tileset = load_tileset(),
         title = "Test game",
         vsync = True,
     ) as context:
+        engine = engine_future.result()
+        if args.record:
+            from action_log import ActionRecorder  #A action_log сам импортирует roguelike через headless
+            engine.event_handler.recorder = ActionRecorder(open(args.record, "wb"), seed, monster_fov = args.monster_fov)
+
         root_console = tcod.Console(SCREEN_WIDTH, SCREEN_HEIGHT, order = "F")
-        while True:
-            engine.render(console = root_console, context = context)
+        frame_interval = 1 / MAX_FPS
+        next_frame = time.perf_counter()
+        first_frame = True
+        try:
+            while True:
+                #A ходы обрабатываются сразу, как приходят события, а кадр рисуется не чаще MAX_FPS и только если что-то поменялось
+                now = time.perf_counter()
+                if engine.game_map.dirty is not None and now >= next_frame:
+                    engine.render(console = root_console, context = context)
+                    next_frame = now + frame_interval
+                    if first_frame:
+                        engine.profiler.mark_first_frame(time.perf_counter() - STARTED)
+                        first_frame = False
 
-            engine.event_handler.handle_events()
+                if engine.game_map.dirty is None:
+                    timeout = None  #A рисовать нечего - спим до следующего события
+                else:
+                    timeout = max(0.0, next_frame - time.perf_counter())
+                engine.event_handler.handle_events(timeout = timeout)
+        finally:
+            if engine.event_handler.recorder is not None:  #A выход идет через SystemExit, лог надо дописать в любом случае
+                engine.event_handler.recorder.close()
+            engine.close()
 
 
 if __name__ == "__main__":
@@ -5,13 +5,15 @@ from game_map import GameMap
 import tile_types
 
 
-import random
-from typing import Iterator, Tuple, List, TYPE_CHECKING
+from typing import Dict, Iterator, Optional, Tuple, List, TYPE_CHECKING
+
+import numpy
+
+from chunked_map import CHUNK_SIZE, ChunkedGameMap
 
 if TYPE_CHECKING:
     from engine import Engine
 
-import tcod
 import entity_factories
 
 class RectangularRoom:
@@ -42,52 +44,107 @@ class RectangularRoom:
             and self.y2 >= other.y1
         )
 
+
+class RoomIndex:
+    """Сетка корзин для проверки пересечений: комната лежит во всех корзинах, которые задевает,
+    и новую комнату сравниваем только с комнатами из ее корзин, а не со всеми подряд.
+    Размер корзины больше максимальной комнаты, так что комната задевает не больше 2x2 корзин."""
+
+    def __init__(self, cell_size: int):
+        self.cell_size = cell_size
+        self.buckets: Dict[Tuple[int, int], List[RectangularRoom]] = {}
+
+    def _cells(self, room: RectangularRoom) -> Iterator[Tuple[int, int]]:
+        size = self.cell_size
+        for bx in range(room.x1 // size, room.x2 // size + 1):
+            for by in range(room.y1 // size, room.y2 // size + 1):
+                yield bx, by
+
+    def intersects_any(self, room: RectangularRoom) -> bool:
+        return any(
+            other.intersects(room)
+            for cell in self._cells(room)
+            for other in self.buckets.get(cell, ())
+        )
+
+    def add(self, room: RectangularRoom) -> None:
+        for cell in self._cells(room):
+            self.buckets.setdefault(cell, []).append(room)
+
+
 def place_entities(
-        room: RectangularRoom, dungeon: GameMap, maximmum_monsters: int,
+        room: RectangularRoom,
+        dungeon: GameMap,
+        maximmum_monsters: int,
+        rng: Optional[numpy.random.Generator] = None,
+        occupied: Optional[numpy.ndarray] = None,
 ) -> None:
-    number_of_monsters = random.randint(0, maximmum_monsters)
+    """Все координаты и виды монстров комнаты разыгрываются одним вызовом генератора.
+    occupied - булева маска занятых клеток на время генерации; без нее занятость проверяется по индексу карты."""
+    rng = rng if rng is not None else numpy.random.default_rng()
+    number_of_monsters = int(rng.integers(0, maximmum_monsters, endpoint=True))
+    if number_of_monsters == 0:
+        return
+
+    xs = rng.integers(room.x1 + 1, room.x2 - 1, size=number_of_monsters, endpoint=True)
+    ys = rng.integers(room.y1 + 1, room.y2 - 1, size=number_of_monsters, endpoint=True)
+    trolls = rng.random(number_of_monsters) < 0.7 #А с вероятностью 70% будет обычный тролль
+
+    #A мы проверяем рандомные координаты чтоб не стакнулись враги: и с уже стоящими, и между собой
+    if occupied is not None:
+        free = ~occupied[xs, ys]
+    else:
+        free = numpy.array([not dungeon.get_entities_at_location(x, y) for x, y in zip(xs.tolist(), ys.tolist())], dtype=bool)
+    _, first = numpy.unique(xs * dungeon.height + ys, return_index=True)
+    keep = numpy.zeros(number_of_monsters, dtype=bool)
+    keep[first] = True
+    keep &= free
+
+    for x, y, troll in zip(xs[keep].tolist(), ys[keep].tolist(), trolls[keep].tolist()):
+        if troll:
+            entity_factories.Troll.spawn(dungeon, x, y)
+        else:
+            entity_factories.BigTroll.spawn(dungeon, x, y)
+    if occupied is not None:
+        occupied[xs[keep], ys[keep]] = True
 
-    for i in range(number_of_monsters):
-        x = random.randint(room.x1 + 1, room.x2 - 1)
-        y = random.randint(room.y1 + 1, room.y2 - 1)
 
-        if not any(entity.x == x and entity.y == y for entity in dungeon.entities):  #A мы проверяем рандомные координаты чтоб не стакнулись враги
-            if random.random() < 0.7: #А с вероятностью 70% будет большой тролль
-                entity_factories.Troll.spawn(dungeon, x, y)
-            else:
-                entity_factories.BigTroll.spawn(dungeon, x, y)
 
 
+def straight_line(start: Tuple[int, int], end: Tuple[int, int]) -> numpy.ndarray:
+    #  Отрезок по горизонтали или вертикали, с обоими концами - то же, что tcod.los.bresenham для таких отрезков,
+    #  но без импорта tcod: генерации подземелья он больше не нужен
+    (x1, y1), (x2, y2) = start, end
+    length = max(abs(x2 - x1), abs(y2 - y1)) + 1
+    line = numpy.empty((length, 2), dtype=numpy.intc)
+    line[:, 0] = numpy.linspace(x1, x2, length).round()
+    line[:, 1] = numpy.linspace(y1, y2, length).round()
+    return line
 
 
-def tunnel_between(                               # Функция принимает два аргумента, оба кортежа, состоящие из двух целых чисел.
-    start: Tuple[int, int], end: Tuple[int, int]  # Он должен возвращать итератор кортежа из двух целых чисел. Все кортежи будут иметь координаты “x“ и ”y" на карте.  
-) -> Iterator[Tuple[int, int]]:
+def tunnel_between(                               # Функция принимает две точки, оба кортежа, состоящие из двух целых чисел, и генератор случайных чисел.
+    start: Tuple[int, int], end: Tuple[int, int], rng: numpy.random.Generator,  # Она возвращает массив (N, 2) координат “x“ и ”y" туннеля на карте.
+) -> numpy.ndarray:
     x1, y1 = start # берем координаты из кортежей.
     x2, y2 = end
     '''Мы случайным образом выбираем между двумя вариантами: перемещение по горизонтали, затем по вертикали или наоборот. 
     Основываясь на том, что выбрано, мы установим значения corner_x и corner_y в разные точки. '''
-    if random.random() < 0.5: # шанс 50%.
+    if rng.random() < 0.5: # шанс 50%.
         # Двигаемся горизонтально, затем вертикально.
         corner_x, corner_y = x2, y1
     else:
         # Двигаемся вертикально, затем горизонтально.
         corner_x, corner_y = x1, y2
 
-    ''' tcod включает в свой модуль прямой видимости функцию для рисования линий Брезенхема. 
-        Хотя в данном случае мы не работаем с прямой видимостью, функция все еще оказывается полезной для получения линии из одной точки в другую. 
-        В этом случае мы получаем одну линию, затем другую, чтобы создать туннель в форме буквы “L”.
-        .tolist() преобразует точки в линии в список.
-        Выражения Yield - интересная часть Python, которая позволяет возвращать “генератор”. 
-        По сути, вместо того, чтобы возвращать значения и вообще выходить из функции, мы возвращаем значения, но сохраняем локальное состояние. 
-        Это позволяет функции продолжить с того места, на котором она остановилась, при повторном вызове, вместо того, чтобы начинать с начала, 
-        как это делает большинство функций. '''
+    ''' Раньше здесь использовалась функция tcod для рисования линий Брезенхема; оба отрезка туннеля идут строго по горизонтали или вертикали,
+        поэтому теперь точки строит straight_line. Мы получаем одну линию, затем другую, чтобы создать туннель в форме буквы “L”.
+        Обе линии - массивы NumPy, мы просто склеиваем их, а карта потом копается одним присваиванием по этим массивам. '''
 
     # Сгенерируем координаты для туннеля. 
-    for x, y in tcod.los.bresenham((x1,y1), (corner_x, corner_y)).tolist():
-        yield x, y
-    for x, y in tcod.los.bresenham((corner_x,corner_y), (x2, y2)).tolist():
-        yield x, y
+    return numpy.concatenate([
+        straight_line((x1,y1), (corner_x, corner_y)),
+        straight_line((corner_x,corner_y), (x2, y2)),
+    ])
 
 
 def generate_dungeon(
@@ -98,42 +155,134 @@ def generate_dungeon(
     MAP_HEIGHT: int,
     max_monsters_per_room: int,
     engine: Engine,
+    seed: Optional[int] = None,
 ) -> GameMap:
-    #  Создаём новое подземелье
+    #  Создаём новое подземелье. Все случайные числа берутся из своего генератора, так что один seed - одно и то же подземелье
+    rng = numpy.random.default_rng(seed)
     player = engine.player
     dungeon = GameMap(engine, MAP_WIDTH, MAP_HEIGHT, entities=[player]) #A entities=[player] добавили чтоб сам игрок был виден в фове
+    occupied = numpy.zeros((MAP_WIDTH, MAP_HEIGHT), dtype=bool, order="F") #A клетки, где уже кто-то стоит
 
     rooms: List[RectangularRoom] = [] # Мы создаём и ведём текущий список всех комнат.
+    room_index = RoomIndex(room_max_size + 1) #A а индекс нужен, чтобы не сравнивать новую комнату со всеми старыми
     ''' Наш алгоритм может размещать или не размещать комнату в зависимости от того, пересекается ли она с другой, поэтому мы не будем знать, 
     сколько комнат у нас в итоге получится. Но, по крайней мере, мы будем знать, что это число не может превышать определенную сумму. '''
     for r in range(max_rooms):
         '''Здесь мы используем заданные минимальные и максимальные размеры комнаты, чтобы задать ширину и высоту комнаты. 
         Затем мы получаем случайную пару x и y координат, чтобы попытаться разместить комнату внизу. Координаты должны быть между 0 и шириной и высотой карты.
         Мы используем эти переменные, чтобы затем создать экземпляр нашего RectangularRoom.'''
-        room_width = random.randint(room_min_size, room_max_size)
-        room_height = random.randint(room_min_size, room_max_size)
+        room_width = int(rng.integers(room_min_size, room_max_size, endpoint=True))
+        room_height = int(rng.integers(room_min_size, room_max_size, endpoint=True))
 
-        x = random.randint(0, dungeon.width - room_width - 1)
-        y = random.randint(0, dungeon.height - room_height - 1)
+        x = int(rng.integers(0, dungeon.width - room_width - 1, endpoint=True))
+        y = int(rng.integers(0, dungeon.height - room_height - 1, endpoint=True))
 
         new_room = RectangularRoom(x, y, room_width, room_height)
 
-        if any(new_room.intersects(other_room) for other_room in rooms): # Если наша комната пересекается с другой комнатой, то мы используем continue,
+        if room_index.intersects_any(new_room): # Если наша комната пересекается с другой комнатой, то мы используем continue,
             continue                                                     # чтобы пропустить остальную часть цикла.
 
-        dungeon.tiles[new_room.inner] = tile_types.floor # Здесь мы “выкапываем” комнату. То есть, присваиваем нашей комнате параметры floor
+        dungeon.set_tiles(new_room.inner, tile_types.floor_id) # Здесь мы “выкапываем” комнату. То есть, присваиваем нашей комнате параметры floor
 
         if len(rooms) == 0:
             # Первая комната, где стартует игрок
             player.place(*new_room.center, dungeon)
+            occupied[player.x, player.y] = True
             '''Мы помещаем нашего игрока в центр первой созданной нами комнаты. Если эта комната не первая, мы переходим к else: '''
         else:
-            # Копаем туннель между предыдущей и нынешней комнатой
-            for x, y in tunnel_between(rooms[-1].center, new_room.center):
-                dungeon.tiles[x, y] = tile_types.floor
+            # Копаем туннель между предыдущей и нынешней комнатой, весь сразу
+            tunnel = tunnel_between(rooms[-1].center, new_room.center, rng)
+            dungeon.set_tiles((tunnel[:, 0], tunnel[:, 1]), tile_types.floor_id)
 
-        place_entities(new_room, dungeon, max_monsters_per_room)
-        # Добавляем комнату в список.
+        place_entities(new_room, dungeon, max_monsters_per_room, rng, occupied)
+        # Добавляем комнату в список и в индекс.
         rooms.append(new_room)
+        room_index.add(new_room)
+
+    return dungeon
+
+def chunk_room(seed: int, cx: int, cy: int, width: int, height: int, room_min_size: int, room_max_size: int) -> Tuple[numpy.random.Generator, Optional[RectangularRoom], Tuple[int, int]]:
+    """Комната чанка (cx, cy) и его "узел", к которому сходятся коридоры. Зависит только от seed и координат чанка,
+    поэтому чанк можно сгенерировать в любой момент и в любом порядке, результат будет тот же."""
+    rng = numpy.random.default_rng([seed, cx, cy])
+    origin_x, origin_y = cx * CHUNK_SIZE, cy * CHUNK_SIZE
+    chunk_width = min(CHUNK_SIZE, width - origin_x)    #  крайние чанки могут быть обрезаны краем карты
+    chunk_height = min(CHUNK_SIZE, height - origin_y)
+    hub = (origin_x + chunk_width // 2, origin_y + chunk_height // 2)
+
+    room_max_size = min(room_max_size, chunk_width - 3, chunk_height - 3)
+    if room_max_size < room_min_size:
+        return rng, None, hub
+
+    room_width = int(rng.integers(room_min_size, room_max_size, endpoint=True))
+    room_height = int(rng.integers(room_min_size, room_max_size, endpoint=True))
+    x = origin_x + int(rng.integers(1, chunk_width - room_width - 2, endpoint=True))
+    y = origin_y + int(rng.integers(1, chunk_height - room_height - 2, endpoint=True))
+    room = RectangularRoom(x, y, room_width, room_height)
+    return rng, room, room.center
+
+
+def carve_chunk(
+    dungeon: ChunkedGameMap,
+    cx: int,
+    cy: int,
+    tiles: numpy.ndarray,
+    seed: int,
+    room_min_size: int,
+    room_max_size: int,
+    max_monsters_per_room: int,
+) -> None:
+    """Генератор одного чанка для ChunkedGameMap: комната и коридоры от нее к серединам сторон чанка.
+    Соседний чанк ведет свой коридор в ту же точку на общей границе, так что все чанки связаны."""
+    rng, room, (hub_x, hub_y) = chunk_room(seed, cx, cy, dungeon.width, dungeon.height, room_min_size, room_max_size)
+    origin_x, origin_y = cx * CHUNK_SIZE, cy * CHUNK_SIZE
+    chunk_width = min(CHUNK_SIZE, dungeon.width - origin_x)
+    chunk_height = min(CHUNK_SIZE, dungeon.height - origin_y)
+    hub_x, hub_y = hub_x - origin_x, hub_y - origin_y  #  дальше работаем в координатах чанка
+    mid_x, mid_y = chunk_width // 2, chunk_height // 2  #  у соседей по общей границе этот размер одинаковый, точки стыка совпадут
+
+    if room:
+        inner_x, inner_y = room.inner
+        tiles[inner_x.start - origin_x:inner_x.stop - origin_x, inner_y.start - origin_y:inner_y.stop - origin_y] = tile_types.floor_id
+
+    if cx > 0:  #  к левой границе: от узла по вертикали до mid_y, потом по горизонтали до края
+        tiles[hub_x, min(hub_y, mid_y):max(hub_y, mid_y) + 1] = tile_types.floor_id
+        tiles[0:hub_x + 1, mid_y] = tile_types.floor_id
+    if origin_x + CHUNK_SIZE < dungeon.width:  #  к правой границе
+        tiles[hub_x, min(hub_y, mid_y):max(hub_y, mid_y) + 1] = tile_types.floor_id
+        tiles[hub_x:chunk_width, mid_y] = tile_types.floor_id
+    if cy > 0:  #  к верхней границе
+        tiles[min(hub_x, mid_x):max(hub_x, mid_x) + 1, hub_y] = tile_types.floor_id
+        tiles[mid_x, 0:hub_y + 1] = tile_types.floor_id
+    if origin_y + CHUNK_SIZE < dungeon.height:  #  к нижней границе
+        tiles[min(hub_x, mid_x):max(hub_x, mid_x) + 1, hub_y] = tile_types.floor_id
+        tiles[mid_x, hub_y:chunk_height] = tile_types.floor_id
+
+    if room:
+        place_entities(room, dungeon, max_monsters_per_room, rng)
+
+
+def generate_chunked_dungeon(
+    MAP_WIDTH: int,
+    MAP_HEIGHT: int,
+    room_min_size: int,
+    room_max_size: int,
+    max_monsters_per_room: int,
+    engine: Engine,
+    seed: int = 0,
+    max_resident_chunks: Optional[int] = None,
+    spill_dir: Optional[str] = None,
+) -> ChunkedGameMap:
+    """Огромное подземелье, которое генерируется по чанкам при первом обращении. Игрок стоит в комнате первого чанка."""
+    player = engine.player
+
+    def generator(dungeon: ChunkedGameMap, cx: int, cy: int, tiles: numpy.ndarray) -> None:
+        carve_chunk(dungeon, cx, cy, tiles, seed, room_min_size, room_max_size, max_monsters_per_room)
 
-    return dungeon
\ No newline at end of file
+    dungeon = ChunkedGameMap(
+        engine, MAP_WIDTH, MAP_HEIGHT, entities=[player],
+        generator=generator, max_resident_chunks=max_resident_chunks, spill_dir=spill_dir,
+    )
+    _, _, start = chunk_room(seed, 0, 0, MAP_WIDTH, MAP_HEIGHT, room_min_size, room_max_size)
+    player.place(*start, dungeon)  #  игрок встает раньше, чем чанк сгенерируется, так что монстры на него не попадут
+    return dungeon
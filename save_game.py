@@ -0,0 +1,293 @@
+"""Сохранение и загрузка уровня в двоичном виде.
+
+Сохранение - это каталог:
+    meta.json                        размеры карты, имена видов плиток и сущностей, строка игрока в таблице
+    tiles.npy, visible.npy, explored.npy    слои обычной GameMap, как есть (порядок "F"); tiles - номера плиток
+    chunks/<слой>/<cx>_<cy>.npy      слои ChunkedGameMap, по файлу на каждый созданный чанк
+    entities.npy                     таблица сущностей по столбцам: вид, x, y, hp
+
+При загрузке слои обычной карты отображаются в память (copy-on-write), а чанки чанковой карты читаются только при первом обращении,
+так что большой уровень не распаковывается целиком. Повторное сохранение в тот же каталог сравнивает данные с уже записанными
+и переписывает только изменившиеся чанки и строки таблицы сущностей. walkable и transparent не сохраняются, они выводятся из tiles.
+Номера плиток переводятся по именам из meta["tile_types"], так что новые виды плиток в реестре старые сохранения не ломают."""
+from __future__ import annotations
+
+import json
+import os
+from typing import Dict, List, NamedTuple, Optional, Tuple, TYPE_CHECKING
+
+import numpy
+
+import entity_factories
+import tile_types
+from chunked_map import CHUNK_SIZE, ChunkedArray, ChunkedGameMap, ChunkGenerator, ChunkStore
+from entity import Actor
+from game_map import GameMap
+
+if TYPE_CHECKING:
+    from engine import Engine
+
+FORMAT_VERSION = 2  #  1 - плитки целыми структурами tile_dt
+LAYERS = ("tiles", "visible", "explored")
+
+entity_dt = numpy.dtype(
+    [
+        ("kind", numpy.uint16),  #  индекс в meta["kinds"], имя прототипа из entity_factories.prototypes
+        ("x", numpy.int32),
+        ("y", numpy.int32),
+        ("hp", numpy.int32),     #  -1 у сущностей без Fighter
+    ]
+)
+
+
+class SaveStats(NamedTuple):  #  сколько чанков и строк сущностей реально записано на диск
+    chunks_written: int
+    chunks_total: int
+    entities_written: int
+    entities_total: int
+
+
+class MappedGameMap(GameMap):
+    """GameMap, слои которой отображены из файлов сохранения. Изменения остаются в памяти и в файлы не попадают."""
+
+    def __init__(self, engine: Engine, path: str, width: int, height: int, tile_map: Optional[numpy.ndarray] = None):
+        self.path = path
+        self.tile_map = tile_map
+        super().__init__(engine, width, height)
+
+    def _create_layers(self) -> None:
+        for name in LAYERS:
+            setattr(self, name, numpy.load(os.path.join(self.path, f"{name}.npy"), mmap_mode="c"))
+        if self.tile_map is not None:
+            self.tiles[...] = self.tile_map.take(self.tiles)
+        #  walkable и transparent выводятся из tiles блоками CHUNK_SIZE x CHUNK_SIZE при первом чтении,
+        #  чтобы загрузка не читала все страницы файла плиток; set_tiles пишет в них как обычно
+        self.walkable = self._derived_plane("walkable")
+        self.transparent = self._derived_plane("transparent")
+
+    def _derived_plane(self, name: str) -> ChunkedArray:
+        tiles = self.tiles
+
+        def decode(cx: int, cy: int, chunk: numpy.ndarray) -> None:
+            block = tiles[cx * CHUNK_SIZE:(cx + 1) * CHUNK_SIZE, cy * CHUNK_SIZE:(cy + 1) * CHUNK_SIZE]
+            chunk[:block.shape[0], :block.shape[1]] = getattr(tile_types.registry, name).take(block)
+
+        return ChunkedArray(ChunkStore(name, (CHUNK_SIZE, CHUNK_SIZE), numpy.dtype(bool), False, generator=decode), self.width, self.height)
+
+    @property
+    def nbytes(self) -> int:  #  отображенные слои целиком плюс уже выведенные блоки walkable и transparent
+        return self.tiles.nbytes + self.visible.nbytes + self.explored.nbytes + self.walkable.store.nbytes + self.transparent.store.nbytes
+
+
+def _replace(path: str, array: numpy.ndarray) -> None:  #  пишем во временный файл и подменяем, чтобы не испортить открытые отображения
+    with open(path + ".tmp", "wb") as file:
+        numpy.save(file, array)
+    os.replace(path + ".tmp", path)
+
+
+def _changed_blocks(saved: numpy.ndarray, array: numpy.ndarray) -> numpy.ndarray:
+    """Маска блоков CHUNK_SIZE x CHUNK_SIZE, в которых массивы отличаются. В порядке "F" полоса из CHUNK_SIZE строк лежит
+    в памяти подряд, поэтому сравниваются сырые байты полосами, а не поля структуры по блокам."""
+    width, height = array.shape
+    blocks_x, blocks_y = -(-width // CHUNK_SIZE), -(-height // CHUNK_SIZE)
+    if not (saved.flags.f_contiguous and array.flags.f_contiguous):
+        cells = numpy.zeros((blocks_x * CHUNK_SIZE, blocks_y * CHUNK_SIZE), dtype=bool)
+        cells[:width, :height] = saved != array
+        return cells.reshape(blocks_x, CHUNK_SIZE, blocks_y, CHUNK_SIZE).any(axis=(1, 3))
+
+    size = array.dtype.itemsize
+    old = saved.reshape(-1, order="F").view(numpy.uint8).reshape(height, width * size)
+    new = array.reshape(-1, order="F").view(numpy.uint8).reshape(height, width * size)
+    columns = numpy.zeros((blocks_y, blocks_x * CHUNK_SIZE), dtype=bool)
+    for by in range(blocks_y):
+        rows = slice(by * CHUNK_SIZE, (by + 1) * CHUNK_SIZE)
+        columns[by, :width] = (old[rows] != new[rows]).any(axis=0).reshape(width, size).any(axis=1)
+    return columns.reshape(blocks_y, blocks_x, CHUNK_SIZE).any(axis=2).T
+
+
+def _save_array(path: str, array: numpy.ndarray) -> Tuple[int, int]:
+    """Пишет слой обычной карты. Если файл того же вида уже есть, переписываются только отличающиеся блоки CHUNK_SIZE x CHUNK_SIZE."""
+    total = -(-array.shape[0] // CHUNK_SIZE) * -(-array.shape[1] // CHUNK_SIZE)
+    if os.path.exists(path):
+        saved = numpy.load(path, mmap_mode="r+")
+        if saved.shape == array.shape and saved.dtype == array.dtype:
+            changed = numpy.argwhere(_changed_blocks(saved, array))
+            for bx, by in changed.tolist():
+                block = slice(bx * CHUNK_SIZE, (bx + 1) * CHUNK_SIZE), slice(by * CHUNK_SIZE, (by + 1) * CHUNK_SIZE)
+                saved[block] = array[block]
+            saved.flush()
+            return len(changed), total
+        del saved
+    _replace(path, numpy.asarray(array))
+    return total, total
+
+
+def _save_store(directory: str, store: ChunkStore, lazy: bool) -> Tuple[int, int]:
+    """Пишет все созданные чанки слоя по отдельным файлам; неизменившиеся чанки не трогаются.
+    Файлы чанков, которых в слое нет, удаляются: такой чанк выброшен как пустой, слой очищен или в каталоге была другая карта.
+    Исключение - lazy, когда слой сам подгружается из этого каталога: тогда это чанки, которые еще не читали."""
+    os.makedirs(directory, exist_ok=True)
+    written = total = 0
+    stale = {name for name in os.listdir(directory) if name.endswith(".npy")}
+    for (cx, cy), chunk in store.items():
+        total += 1
+        name = f"{cx}_{cy}.npy"
+        stale.discard(name)
+        path = os.path.join(directory, name)
+        if os.path.exists(path) and numpy.array_equal(numpy.load(path, mmap_mode="r"), chunk):
+            continue
+        _replace(path, chunk)
+        written += 1
+    if not lazy:
+        for name in stale:
+            os.remove(os.path.join(directory, name))
+    return written, total
+
+
+def _entity_table(game_map: GameMap, kinds: List[str]) -> Tuple[numpy.ndarray, int]:
+    index = {name: number for number, name in enumerate(kinds)}
+    table = numpy.empty(len(game_map.entities), dtype=entity_dt)
+    player_row = -1
+    for row, entity in enumerate(game_map.entities):
+        if entity.name not in index:
+            raise ValueError(f"{entity.name!r} is not registered in entity_factories.prototypes")
+        hp = entity.fighter.hp if isinstance(entity, Actor) else -1
+        table[row] = (index[entity.name], entity.x, entity.y, hp)
+        if entity is game_map.engine.player:
+            player_row = row
+    return table, player_row
+
+
+def _save_entities(path: str, table: numpy.ndarray) -> int:  #  строки сравниваются по порядку добавления на карту
+    if os.path.exists(path):
+        saved = numpy.load(path, mmap_mode="r+")
+        if saved.shape == table.shape and saved.dtype == table.dtype:
+            changed = numpy.flatnonzero(saved != table)
+            saved[changed] = table[changed]
+            saved.flush()
+            return len(changed)
+        del saved
+    _replace(path, table)
+    return len(table)
+
+
+def save(game_map: GameMap, path: str) -> SaveStats:
+    """Сохраняет уровень в каталог path. Если там уже лежит сохранение этой же карты, дописываются только изменения."""
+    os.makedirs(path, exist_ok=True)
+    meta_path = os.path.join(path, "meta.json")
+    kinds = list(entity_factories.prototypes)
+    old_meta: Dict[str, object] = {}
+    if os.path.exists(meta_path):
+        with open(meta_path) as file:
+            old_meta = json.load(file)
+
+    chunks_written = chunks_total = 0
+    chunked = isinstance(game_map, ChunkedGameMap)
+    #  чанки, которые карта еще не прочитала из своего сохранения, есть только в его файлах
+    #  realpath, а не samefile: исходного каталога сохранения может уже не быть
+    same_save = chunked and game_map.save_path is not None and os.path.realpath(game_map.save_path) == os.path.realpath(path)
+    for name in LAYERS:
+        layer = getattr(game_map, name)
+        if chunked:
+            lazy = same_save and layer.store.generator is not None  #  clear_visible отключает загрузку видимости
+            written, total = _save_store(os.path.join(path, "chunks", name), layer.store, lazy)
+        else:
+            written, total = _save_array(os.path.join(path, f"{name}.npy"), layer)
+        chunks_written += written
+        chunks_total += total
+
+    table, player_row = _entity_table(game_map, kinds)
+    entities_path = os.path.join(path, "entities.npy")
+    if old_meta.get("kinds") != kinds and os.path.exists(entities_path):
+        os.remove(entities_path)  #  индексы видов поменялись, построчное сравнение бессмысленно
+    entities_written = _save_entities(entities_path, table)
+
+    meta = {
+        "version": FORMAT_VERSION,
+        "width": game_map.width,
+        "height": game_map.height,
+        "chunked": chunked,
+        "chunk_size": CHUNK_SIZE,
+        "tile_types": list(tile_types.registry.names),
+        "kinds": kinds,
+        "player": player_row,
+    }
+    if meta != old_meta:
+        with open(meta_path + ".tmp", "w") as file:
+            json.dump(meta, file)
+        os.replace(meta_path + ".tmp", meta_path)
+
+    return SaveStats(chunks_written, chunks_total, entities_written, len(table))
+
+
+def _tile_map(names: List[str]) -> Optional[numpy.ndarray]:
+    """Таблица "номер плитки в сохранении -> номер в реестре", или None, если номера совпадают."""
+    registered = tile_types.registry.names
+    if names == registered[:len(names)]:
+        return None
+    missing = [name for name in names if name not in registered]
+    if missing:
+        raise ValueError(f"save uses unknown tile types {missing}")
+    return numpy.array([registered.index(name) for name in names], dtype=tile_types.tile_id_dt)
+
+
+def _chunk_loader(directory: str, fallback: Optional[ChunkGenerator] = None, lookup: Optional[numpy.ndarray] = None) -> ChunkGenerator:
+    saved = {name[:-len(".npy")] for name in os.listdir(directory)} if os.path.isdir(directory) else set()
+
+    def load_chunk(game_map: ChunkedGameMap, cx: int, cy: int, chunk: numpy.ndarray) -> None:
+        if f"{cx}_{cy}" in saved:
+            chunk[...] = numpy.load(os.path.join(directory, f"{cx}_{cy}.npy"))
+            if lookup is not None:
+                chunk[...] = lookup.take(chunk)
+        elif fallback is not None:
+            fallback(game_map, cx, cy, chunk)
+
+    return load_chunk
+
+
+def load(
+    path: str,
+    engine: Engine,
+    generator: Optional[ChunkGenerator] = None,
+    max_resident_chunks: Optional[int] = None,
+    spill_dir: Optional[str] = None,
+) -> GameMap:
+    """Загружает уровень и ставит на него engine.player. Для чанковой карты generator строит чанки, которых нет в сохранении."""
+    with open(os.path.join(path, "meta.json")) as file:
+        meta = json.load(file)
+    if meta["version"] != FORMAT_VERSION:
+        raise ValueError(f"unsupported save version {meta['version']}")
+    width, height = meta["width"], meta["height"]
+    tile_map = _tile_map(meta["tile_types"])
+
+    if meta["chunked"]:
+        if meta["chunk_size"] != CHUNK_SIZE:
+            raise ValueError(f"save uses chunks of {meta['chunk_size']}, expected {CHUNK_SIZE}")
+        chunks = os.path.join(path, "chunks")
+        game_map: GameMap = ChunkedGameMap(
+            engine,
+            width,
+            height,
+            generator=_chunk_loader(os.path.join(chunks, "tiles"), generator, tile_map),
+            max_resident_chunks=max_resident_chunks,
+            spill_dir=spill_dir,
+        )
+        for name in ("visible", "explored"):
+            load_chunk = _chunk_loader(os.path.join(chunks, name))
+            getattr(game_map, name).store.generator = lambda cx, cy, chunk, load_chunk=load_chunk: load_chunk(game_map, cx, cy, chunk)
+        game_map.save_path = path
+    else:
+        game_map = MappedGameMap(engine, path, width, height, tile_map)
+
+    prototypes = [entity_factories.prototypes[name] for name in meta["kinds"]]
+    table = numpy.load(os.path.join(path, "entities.npy"))
+    for row, (kind, x, y, hp) in enumerate(table.tolist()):
+        if row == meta["player"]:
+            entity = engine.player
+            entity.place(x, y, game_map)
+        else:
+            entity = prototypes[kind].spawn(game_map, x, y)
+        if hp >= 0:
+            entity.fighter.hp = hp
+
+    return game_map
@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+import heapq
+from typing import Callable, Dict, List, Optional, TYPE_CHECKING
+
+import numpy
+
+if TYPE_CHECKING:
+    from entity import Actor
+    from entity_arrays import EntityArrays
+
+ACTION_COST = 100   #  столько времени стоит одно действие при нормальной скорости
+NORMAL_SPEED = 100  #  скорость игрока: за его ход проходит ровно ACTION_COST
+
+
+class TurnScheduler:
+    """Очередь ходов врагов одной карты. Актеры лежат в корзинах по времени следующего хода, а сами времена - в куче.
+    Актер со скоростью speed ходит раз в ACTION_COST * NORMAL_SPEED // speed единиц времени; при равном времени первым ходит тот,
+    кто раньше попал на карту, так что при одинаковой скорости порядок тот же, что у перебора game_map.actors.
+    Актер, которому нечего делать (ai.idle), засыпает и не стоит в очереди, пока его клетка не станет видимой,
+    поэтому ход стоит столько, сколько активных актеров, а не сколько их всего на карте."""
+
+    def __init__(self, arrays: EntityArrays):
+        self.arrays = arrays
+        self.now = 0
+        self.times: List[int] = []  #  куча времен, для которых есть корзина
+        self.buckets: Dict[int, Dict[Actor, None]] = {}
+        self.scheduled: Dict[Actor, int] = {}  #  актер -> время, в корзине которого он лежит
+        self.sleeping: Dict[Actor, None] = {}
+        self.order: Dict[Actor, int] = {}
+        self._next_order = 0
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    @property
+    def active(self) -> int:
+        return len(self.scheduled)
+
+    def add(self, actor: Actor) -> None:
+        if actor in self.order:
+            return
+        self.order[actor] = self._next_order
+        self._next_order += 1
+        self._push(actor, self.now)
+
+    def remove(self, actor: Actor) -> None:
+        self.order.pop(actor, None)
+        self.sleeping.pop(actor, None)
+        time = self.scheduled.pop(actor, None)
+        if time is not None:
+            del self.buckets[time][actor]  #  пустая корзина останется и будет пропущена
+
+    def wake(self, actor: Actor) -> None:
+        if actor in self.sleeping:
+            del self.sleeping[actor]
+            self._push(actor, self.now)
+
+    def _push(self, actor: Actor, time: int) -> None:
+        self.scheduled[actor] = time
+        bucket = self.buckets.get(time)
+        if bucket is None:
+            bucket = self.buckets[time] = {}
+            heapq.heappush(self.times, time)
+        bucket[actor] = None
+
+    def wake_visible(self, visible: numpy.ndarray, x1: int, y1: int, x2: int, y2: int) -> None:
+        """Будит спящих актеров, стоящих на видимых клетках прямоугольника (окна ФОВа)."""
+        if not self.sleeping:
+            return
+        entities, sleeping = self.arrays.entities, self.sleeping
+        for slot in self.arrays.slots_on_visible(visible, x1, y1, x2, y2).tolist():
+            if entities[slot] in sleeping:
+                self.wake(entities[slot])
+
+    def wake_watching(self, sees: Callable[[numpy.ndarray, numpy.ndarray], numpy.ndarray], x1: int, y1: int, x2: int, y2: int) -> None:
+        """Будит спящих актеров прямоугольника, для клеток которых sees(xs, ys) истинно. Нужно, когда у врагов свое зрение
+        (Engine.fov_service): ФОВ не симметричен, и враг может видеть игрока, стоя на клетке, которую игрок не видит."""
+        if not self.sleeping:
+            return
+        entities, sleeping = self.arrays.entities, self.sleeping
+        slots = numpy.array([slot for slot in self.arrays.slots_in(x1, y1, x2, y2).tolist() if entities[slot] in sleeping], dtype=numpy.intp)
+        if slots.size == 0:
+            return
+        for slot in slots[sees(self.arrays.x[slots], self.arrays.y[slots])].tolist():
+            self.wake(entities[slot])
+
+    def run_turn(self, perform_batch: Optional[Callable[[List[Actor]], None]] = None) -> None:
+        """Проходит один ход игрока: выполняет всех актеров, чье время наступило, и сдвигает часы на ACTION_COST.
+        Актеры с одинаковым временем (одна корзина) идут одним пакетом: perform_batch(actors) должен выполнить их ходы по порядку
+        (по умолчанию просто ai.perform() для каждого). Следующий ход актера всегда позже, так что пакет не меняет порядок."""
+        times, buckets, scheduled, order = self.times, self.buckets, self.scheduled, self.order
+        while times and times[0] <= self.now:
+            time = heapq.heappop(times)
+            bucket = buckets.pop(time)
+            batch = sorted(bucket, key=order.__getitem__)
+            for actor in batch:
+                del scheduled[actor]
+            batch = [actor for actor in batch if actor.ai]  #  мертвый актер просто выпадает из очереди
+
+            if perform_batch is not None:
+                perform_batch(batch)
+            else:
+                for actor in batch:
+                    if actor.ai:
+                        actor.ai.perform()
+
+            for actor in batch:
+                if actor not in order or not actor.ai:  #  за свой ход актер мог покинуть карту или умереть
+                    continue
+                if actor.ai.idle:
+                    self.sleeping[actor] = None
+                else:
+                    self._push(actor, time + ACTION_COST * NORMAL_SPEED // actor.speed)
+        self.now += ACTION_COST
@@ -0,0 +1,357 @@
+"""Игровой сервер: много независимых игр в одном цикле asyncio.
+
+    python server.py --port 7777              игроки подключаются через nc/telnet (терминал в raw режиме)
+    python server.py --unix /tmp/rogue.sock
+    python server.py --bench 200 --duration 10  нагрузочный прогон с ботами, печатает сколько сессий тянет одно ядро
+
+Каждое подключение - своя Session: свой Engine, своя карта, своя внеэкранная консоль. Игрок и монстры клонируются
+из прототипов entity_factories, так что общего изменяемого состояния у сессий нет. Подземелье новой сессии строится
+в пуле потоков, чтобы подключение не останавливало чужие игры. Ход считается синхронно,
+между ходами сессия отдает управление циклу, а запись в медленный сокет ждет только свою сессию.
+
+Кадры идут через terminal_output.DeltaEncoder: после первого полного кадра клиент получает только изменившиеся клетки
+(ANSI для терминала, --binary для своих клиентов), а полный кадр - раз в --keyframe-interval кадров или по Ctrl-L.
+
+Клавиши: стрелки, wasd, hjkl и yubn (диагонали), "." - ждать, Ctrl-L - перерисовать экран, q - выйти."""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import random
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+import tcod.console
+
+import roguelike
+import terminal_output
+from actions import Action, BumpAction, WaitAction
+from engine import Engine
+from turn_profiler import TurnProfiler
+
+QUIT = b"q"
+REDRAW = b"\x0c"  #  Ctrl-L
+KEYS: Dict[bytes, Optional[Tuple[int, int]]] = {  #  None - пропустить ход
+    b"\x1b[A": (0, -1), b"\x1b[B": (0, 1), b"\x1b[C": (1, 0), b"\x1b[D": (-1, 0),
+    b"w": (0, -1), b"s": (0, 1), b"d": (1, 0), b"a": (-1, 0),
+    b"k": (0, -1), b"j": (0, 1), b"l": (1, 0), b"h": (-1, 0),
+    b"y": (-1, -1), b"u": (1, -1), b"b": (-1, 1), b"n": (1, 1),
+    b".": None,
+}
+READ_SIZE = 256
+
+
+def parse_keys(data: bytes) -> Tuple[List[bytes], bytes]:
+    """Режет ввод на клавиши из KEYS, QUIT и REDRAW. Возвращает клавиши и хвост - начало escape-последовательности, которая еще не пришла целиком.
+    Остальные байты (перевод строки от nc, незнакомые клавиши) пропускаются."""
+    keys = []
+    index = 0
+    while index < len(data):
+        if data[index] == 0x1B:
+            sequence = data[index:index + 3]
+            if len(sequence) < 3 and b"\x1b[".startswith(sequence):
+                return keys, sequence
+            if sequence in KEYS:
+                keys.append(sequence)
+                index += 3
+                continue
+        key = data[index:index + 1]
+        if key in KEYS or key == QUIT or key == REDRAW:
+            keys.append(key)
+        index += 1
+    return keys, b""
+
+
+class ServerStats:
+    """Загрузка сервера. busy - сколько секунд цикл считал ходы и кадры; отношение busy к времени работы - загрузка ядра,
+    а среднее число сессий, деленное на загрузку, - сколько таких сессий выдержит одно ядро."""
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.busy = 0.0
+        self.turns = 0
+        self.frames = 0
+        self.bytes_sent = 0
+        self.sessions = 0
+        self.peak_sessions = 0
+        self.total_sessions = 0
+        self._session_time = 0.0  #  секунды жизни закрытых сессий
+        self._opened: Dict[int, float] = {}
+
+    def open(self, session_id: int) -> None:
+        self.sessions += 1
+        self.total_sessions += 1
+        self.peak_sessions = max(self.peak_sessions, self.sessions)
+        self._opened[session_id] = time.perf_counter()
+
+    def close(self, session_id: int) -> None:
+        self.sessions -= 1
+        self._session_time += time.perf_counter() - self._opened.pop(session_id)
+
+    @property
+    def load(self) -> float:
+        return self.busy / max(time.perf_counter() - self.started, 1e-9)
+
+    @property
+    def average_sessions(self) -> float:
+        now = time.perf_counter()
+        open_time = sum(now - opened for opened in self._opened.values())
+        return (self._session_time + open_time) / max(now - self.started, 1e-9)
+
+    @property
+    def sessions_per_core(self) -> float:
+        return self.average_sessions / self.load if self.busy else 0.0
+
+    def report(self) -> str:
+        wall = time.perf_counter() - self.started
+        return (
+            f"{self.sessions} sessions (peak {self.peak_sessions}, total {self.total_sessions}), "
+            f"{self.turns} turns ({self.turns / wall:.1f}/s), {self.frames} frames, {self.bytes_sent / 1024:.0f} KiB sent "
+            f"({self.bytes_sent / max(self.frames, 1):.0f} B/frame), "
+            f"core load {self.load * 100:.1f}%, ~{self.sessions_per_core:.0f} sessions per core"
+        )
+
+
+class Session:
+    """Одна игра: свой движок и своя консоль. Ничего не знает о сокетах, только превращает клавиши в кадры."""
+
+    def __init__(
+        self,
+        session_id: int,
+        seed: int,
+        output: Optional[terminal_output.DeltaEncoder] = None,
+        engine: Optional[Engine] = None,
+    ):
+        self.id = session_id
+        self.seed = seed
+        self.engine = engine if engine is not None else roguelike.new_engine(seed)
+        self.engine.profiler = TurnProfiler()  #  общий профайлер процесса смешал бы ходы разных игроков
+        self.console = tcod.console.Console(roguelike.SCREEN_WIDTH, roguelike.SCREEN_HEIGHT, order="F")
+        self.output = output if output is not None else terminal_output.DeltaEncoder()
+        self.message = ""
+        self._sent_message: Optional[str] = None
+        self.turns = 0
+
+    def action(self, key: bytes) -> Action:
+        player = self.engine.player
+        direction = KEYS[key]
+        if direction is None:
+            return WaitAction(player)
+        return BumpAction(player, *direction)
+
+    def turn(self, key: bytes) -> None:
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):  #  сообщения MeleeAction уходят этому игроку, а не в консоль сервера
+            self.engine.event_handler.handle_action(self.action(key))
+        self.turns += 1
+        if output.getvalue():
+            self.message = output.getvalue().splitlines()[-1]
+
+    def redraw(self) -> None:  #  клиент потерял экран: следующий кадр уйдет целиком
+        self.output.request_keyframe()
+        self._sent_message = None
+        self.engine.game_map.mark_all_dirty()
+
+    def frame(self) -> Optional[bytes]:
+        """Изменения экрана с прошлого кадра или None, если на карте ничего не поменялось.
+        Строка сообщения под картой есть только в ANSI и отправляется, когда меняется."""
+        if self.engine.game_map.dirty is None:
+            return None
+        self.engine.render(self.console)
+        data = self.output.encode(self.console)
+        if not self.output.binary and self.message != self._sent_message:
+            data += f"\x1b[{self.console.height + 1};1H\x1b[0m\x1b[K{self.message}".encode()
+            self._sent_message = self.message
+        return data
+
+
+class GameServer:
+    def __init__(
+        self,
+        seed: Optional[int] = None,
+        max_sessions: Optional[int] = None,
+        binary: bool = False,
+        keyframe_interval: int = terminal_output.KEYFRAME_INTERVAL,
+    ):
+        self.seed = seed if seed is not None else random.randrange(2 ** 32)
+        self.max_sessions = max_sessions
+        self.binary = binary
+        self.keyframe_interval = keyframe_interval
+        self.stats = ServerStats()
+        self.sessions: Dict[int, Session] = {}
+        self._next_id = 0
+        self._starting = 0  #  сессии, для которых подземелье еще строится; в max_sessions они уже считаются
+
+    async def new_session(self) -> Session:
+        session_id = self._next_id
+        self._next_id += 1
+        seed = (self.seed + session_id) % 2 ** 32
+
+        def build() -> Tuple[Engine, float]:
+            start = time.perf_counter()
+            engine = roguelike.new_engine(seed)
+            return engine, time.perf_counter() - start
+
+        #  генерация - самая долгая часть подключения, в цикле она задержала бы ходы всех остальных сессий
+        self._starting += 1
+        try:
+            engine, seconds = await asyncio.get_running_loop().run_in_executor(None, build)
+        finally:
+            self._starting -= 1
+        start = time.perf_counter()
+        output = terminal_output.DeltaEncoder(self.binary, self.keyframe_interval)
+        session = Session(session_id, seed, output, engine)
+        self.stats.busy += seconds + time.perf_counter() - start
+        self.sessions[session_id] = session
+        self.stats.open(session_id)
+        return session
+
+    def close_session(self, session: Session) -> None:
+        del self.sessions[session.id]
+        self.stats.close(session.id)
+        session.engine.close()
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        if self.max_sessions is not None and len(self.sessions) + self._starting >= self.max_sessions:
+            writer.write(b"server is full\r\n")
+            await self._close(writer)
+            return
+
+        session = await self.new_session()
+        try:
+            self.stats.frames += 1
+            await self._send(writer, (b"" if self.binary else terminal_output.CLEAR) + (session.frame() or b""))
+            pending = b""
+            playing = True
+            while playing:
+                data = await reader.read(READ_SIZE)
+                if not data:
+                    break
+                keys, pending = parse_keys(pending + data)
+                if QUIT in keys:
+                    keys = keys[:keys.index(QUIT)]
+                    playing = False
+                for index, key in enumerate(keys):
+                    if key == REDRAW:
+                        session.redraw()
+                        continue
+                    if index:
+                        await asyncio.sleep(0)  #  игрок, приславший пачку клавиш, не задерживает остальных дольше одного хода
+                    start = time.perf_counter()
+                    session.turn(key)
+                    self.stats.busy += time.perf_counter() - start
+                    self.stats.turns += 1
+                start = time.perf_counter()
+                frame = session.frame()  #  после пачки ходов рисуется только последнее состояние
+                self.stats.busy += time.perf_counter() - start
+                if frame is not None:
+                    self.stats.frames += 1
+                    await self._send(writer, frame)
+            if not self.binary:
+                writer.write(terminal_output.RESTORE)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.close_session(session)
+            await self._close(writer)
+
+    async def _send(self, writer: asyncio.StreamWriter, data: bytes) -> None:
+        writer.write(data)
+        self.stats.bytes_sent += len(data)
+        await writer.drain()  #  медленный клиент ждет здесь сам, остальные сессии идут дальше
+
+    async def _close(self, writer: asyncio.StreamWriter) -> None:
+        writer.close()
+        with contextlib.suppress(ConnectionError):
+            await writer.wait_closed()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 7777, unix: Optional[str] = None) -> asyncio.AbstractServer:
+        if unix:
+            return await asyncio.start_unix_server(self.handle_client, path=unix)
+        return await asyncio.start_server(self.handle_client, host, port)
+
+    async def report_every(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            print(self.stats.report(), flush=True)
+
+
+async def bot(path: str, rate: float, seed: int, stop: float) -> int:
+    """Клиент для нагрузочного прогона: жмет случайные клавиши rate раз в секунду и читает все кадры."""
+    reader, writer = await asyncio.open_unix_connection(path)
+    rng = random.Random(seed)
+    keys = [key for key in KEYS if len(key) == 1]
+    received = 0
+
+    async def drain_frames() -> None:
+        nonlocal received
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                return
+            received += len(data)
+
+    reading = asyncio.ensure_future(drain_frames())
+    await asyncio.sleep(rng.random() / rate)  #  боты жмут клавиши не одновременно
+    while time.perf_counter() < stop:
+        writer.write(rng.choice(keys))
+        await writer.drain()
+        await asyncio.sleep(1 / rate)
+    writer.write(QUIT)
+    await writer.drain()
+    await reading
+    writer.close()
+    return received
+
+
+async def bench(server: GameServer, clients: int, duration: float, rate: float) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "server.sock")
+        listener = await server.start(unix=path)
+        stop = time.perf_counter() + duration
+        await asyncio.gather(*(bot(path, rate, seed, stop) for seed in range(clients)))
+        listener.close()
+        await listener.wait_closed()
+    print(server.stats.report())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Host many independent games over TCP or a Unix socket.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7777)
+    parser.add_argument("--unix", metavar="PATH", default=None, help="listen on a Unix socket instead of TCP")
+    parser.add_argument("--seed", type=int, default=None, help="session N plays dungeon seed + N")
+    parser.add_argument("--max-sessions", type=int, default=None)
+    parser.add_argument("--binary", action="store_true", help="send binary frames instead of ANSI (see terminal_output)")
+    parser.add_argument("--keyframe-interval", type=int, default=terminal_output.KEYFRAME_INTERVAL, help="frames between full frames")
+    parser.add_argument("--stats-interval", type=float, default=10.0, help="seconds between load reports, 0 to disable")
+    parser.add_argument("--bench", type=int, metavar="CLIENTS", default=None, help="run CLIENTS bots against an in-process server and exit")
+    parser.add_argument("--duration", type=float, default=10.0, help="bench length in seconds")
+    parser.add_argument("--rate", type=float, default=5.0, help="keys per second per bot")
+    args = parser.parse_args()
+
+    server = GameServer(args.seed, args.max_sessions, args.binary, args.keyframe_interval)
+    if args.bench is not None:
+        asyncio.run(bench(server, args.bench, args.duration, args.rate))
+        return
+
+    async def serve() -> None:
+        listener = await server.start(args.host, args.port, args.unix)
+        print(f"listening on {args.unix or f'{args.host}:{args.port}'}", flush=True)
+        if args.stats_interval > 0:
+            asyncio.ensure_future(server.report_every(args.stats_interval))
+        async with listener:
+            await listener.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        print(server.stats.report())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""Вывод консоли tcod в терминал или удаленному клиенту.
+
+ansi_frame пишет весь кадр escape-последовательностями ANSI (24-битный цвет). DeltaEncoder помнит последний
+отправленный кадр и отдает только изменившиеся клетки, а раз в keyframe_interval кадров (или по запросу) - полный
+кадр, чтобы клиент, который что-то потерял или только подключился, собрал экран заново.
+
+Изменившиеся клетки идут отрезками подряд по строке. В ANSI перед отрезком ставится курсор, а цвет переключается
+только там, где меняется пара (fg, bg). Двоичный вид кадра:
+    заголовок "<cHHH": b"K" (полный кадр) или b"D" (разница), ширина, высота, число отрезков
+    отрезок "<HHH": x, y, длина, затем длина клеток cell_dt
+У полного кадра отрезки после заголовка сжаты zlib: экран в основном из одинаковых клеток, а кадр на 10 байт в клетке иначе огромный."""
+from __future__ import annotations
+
+import struct
+import zlib
+from typing import Optional, Tuple, TYPE_CHECKING
+
+import numpy
+
+if TYPE_CHECKING:
+    from tcod.console import Console
+
+CLEAR = b"\x1b[0m\x1b[2J\x1b[?25l"  #  сбросить цвет, очистить экран, спрятать курсор
+RESTORE = b"\x1b[0m\x1b[?25h\r\n"   #  вернуть терминал как было
+
+KEYFRAME_INTERVAL = 300  #  кадров между полными кадрами
+
+FRAME_HEADER = struct.Struct("<cHHH")
+RUN_HEADER = struct.Struct("<HHH")
+cell_dt = numpy.dtype([("ch", "<u4"), ("fg", "3u1"), ("bg", "3u1")])
+
+
+def cell_text(ch: numpy.ndarray) -> str:
+    """Символы консоли (коды Юникода) одной строкой, по одному символу на клетку."""
+    return ch.astype("<u4").tobytes().decode("utf-32-le")
+
+
+def color_code(colors: list) -> str:  #  [r, g, b, R, G, B] -> SGR для fg и bg
+    return "\x1b[38;2;{};{};{};48;2;{};{};{}m".format(*colors)
+
+
+def flatten(console: Console) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """Символы и цвета (fg, bg по 3 байта) всех клеток построчно, как их видит терминал. Консоль в порядке "F" индексируется [x, y]."""
+    ch = console.ch.T.flatten()  #  копия: DeltaEncoder хранит ее до следующего кадра, а консоль рисуется на месте
+    colors = numpy.concatenate([console.fg.transpose(1, 0, 2), console.bg.transpose(1, 0, 2)], axis=2).reshape(-1, 6)
+    return ch, colors
+
+
+def _run_starts(cells: numpy.ndarray, width: int) -> numpy.ndarray:
+    """Где в отсортированных индексах клеток начинается новый отрезок: разрыв или переход на следующую строку."""
+    starts = numpy.ones(cells.size, dtype=bool)
+    starts[1:] = (numpy.diff(cells) != 1) | (cells[1:] % width == 0)
+    return starts
+
+
+def encode_ansi(ch: numpy.ndarray, colors: numpy.ndarray, cells: numpy.ndarray, width: int) -> bytes:
+    if cells.size == 0:
+        return b""
+    moved = _run_starts(cells, width)
+    cell_colors = colors[cells]
+    pieces = moved.copy()
+    pieces[1:] |= (cell_colors[1:] != cell_colors[:-1]).any(axis=1)
+    starts = numpy.flatnonzero(pieces)
+    stops = numpy.append(starts[1:], cells.size)
+    text = cell_text(ch[cells])
+
+    parts = []
+    current: Optional[list] = None
+    for start, stop, cell, jump, color in zip(
+        starts.tolist(), stops.tolist(), cells[starts].tolist(), moved[starts].tolist(), cell_colors[starts].tolist()
+    ):
+        if jump:
+            parts.append(f"\x1b[{cell // width + 1};{cell % width + 1}H")
+        if color != current:
+            parts.append(color_code(color))
+            current = color
+        parts.append(text[start:stop])
+    parts.append("\x1b[0m")
+    return "".join(parts).encode()
+
+
+def encode_binary(ch: numpy.ndarray, colors: numpy.ndarray, cells: numpy.ndarray, width: int, height: int, keyframe: bool) -> bytes:
+    records = numpy.empty(cells.size, dtype=cell_dt)
+    records["ch"] = ch[cells]
+    records["fg"] = colors[cells, :3]
+    records["bg"] = colors[cells, 3:]
+    data = records.tobytes()
+    starts = numpy.flatnonzero(_run_starts(cells, width)) if cells.size else numpy.zeros(0, dtype=numpy.intp)
+    stops = numpy.append(starts[1:], cells.size)
+
+    size = cell_dt.itemsize
+    parts = []
+    for start, stop, cell in zip(starts.tolist(), stops.tolist(), cells[starts].tolist()):
+        parts.append(RUN_HEADER.pack(cell % width, cell // width, stop - start))
+        parts.append(data[start * size:stop * size])
+    body = b"".join(parts)
+    if keyframe:
+        body = zlib.compress(body, 1)
+    return FRAME_HEADER.pack(b"K" if keyframe else b"D", width, height, starts.size) + body
+
+
+def apply_binary(frame: bytes, screen: Optional[numpy.ndarray] = None) -> numpy.ndarray:
+    """Собирает экран клиента: screen[y, x] из cell_dt. Полный кадр начинает новый экран, разница дописывается в screen."""
+    kind, width, height, runs = FRAME_HEADER.unpack_from(frame)
+    offset = FRAME_HEADER.size
+    if kind == b"K" or screen is None:
+        screen = numpy.zeros((height, width), dtype=cell_dt)
+    if kind == b"K":
+        frame, offset = zlib.decompress(frame[offset:]), 0
+    flat = screen.reshape(-1)
+    for _ in range(runs):
+        x, y, length = RUN_HEADER.unpack_from(frame, offset)
+        offset += RUN_HEADER.size
+        flat[y * width + x:y * width + x + length] = numpy.frombuffer(frame, dtype=cell_dt, count=length, offset=offset)
+        offset += length * cell_dt.itemsize
+    return screen
+
+
+def ansi_frame(console: Console) -> bytes:
+    """Весь кадр консоли в ANSI."""
+    ch, colors = flatten(console)
+    return encode_ansi(ch, colors, numpy.arange(ch.size), console.width)
+
+
+class FrameStats:
+    """Сколько кадров и байт отдал DeltaEncoder."""
+
+    __slots__ = ("frames", "keyframes", "bytes", "cells", "last_bytes")
+
+    def __init__(self) -> None:
+        self.frames = 0
+        self.keyframes = 0
+        self.bytes = 0
+        self.cells = 0  #  клеток отправлено, всего
+        self.last_bytes = 0
+
+    @property
+    def bytes_per_frame(self) -> float:
+        return self.bytes / self.frames if self.frames else 0.0
+
+    def __repr__(self) -> str:
+        return (
+            f"FrameStats(frames={self.frames}, keyframes={self.keyframes}, "
+            f"bytes_per_frame={self.bytes_per_frame:.0f}, cells_per_frame={self.cells / max(self.frames, 1):.0f})"
+        )
+
+
+class DeltaEncoder:
+    """Кодирует кадры консоли относительно последнего отправленного. binary=False - ANSI для терминала, True - двоичный вид."""
+
+    def __init__(self, binary: bool = False, keyframe_interval: int = KEYFRAME_INTERVAL):
+        self.binary = binary
+        self.keyframe_interval = keyframe_interval
+        self.stats = FrameStats()
+        self._last: Optional[Tuple[numpy.ndarray, numpy.ndarray]] = None
+        self._since_keyframe = 0
+
+    def request_keyframe(self) -> None:  #  следующий кадр уйдет целиком
+        self._last = None
+
+    def encode(self, console: Console) -> bytes:
+        ch, colors = flatten(console)
+        width, height = console.width, console.height
+        last = self._last
+        keyframe = last is None or last[0].size != ch.size or self._since_keyframe >= self.keyframe_interval
+        if not keyframe:
+            cells = numpy.flatnonzero((ch != last[0]) | (colors != last[1]).any(axis=1))
+            keyframe = cells.size * 2 > ch.size  #  поменялась большая часть экрана - полный кадр не длиннее
+        if keyframe:
+            cells = numpy.arange(ch.size)
+            self._since_keyframe = 0
+            self.stats.keyframes += 1
+        else:
+            self._since_keyframe += 1
+
+        if self.binary:
+            data = encode_binary(ch, colors, cells, width, height, keyframe)
+        else:
+            data = encode_ansi(ch, colors, cells, width)
+        self._last = (ch, colors)
+
+        stats = self.stats
+        stats.frames += 1
+        stats.bytes += len(data)
+        stats.cells += cells.size
+        stats.last_bytes = len(data)
+        return data
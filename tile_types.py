@@ -1,4 +1,4 @@
-﻿from typing import Tuple
+﻿from typing import List, Tuple
 
 import numpy
 import numpy as np
@@ -54,4 +54,52 @@ wall = new_tile(
     transparent=False,
     dark=(ord(" "), (255, 255, 255), (0, 0, 100)),
     light=(ord(" "), (255, 255, 255), (130, 110, 50)),
-)
\ No newline at end of file
+)
+
+
+tile_id_dt = numpy.dtype(numpy.uint8)  #A номер плитки в реестре; если видов станет больше 256, хватит поменять на uint16
+
+
+class TileRegistry:
+    """Все виды плиток по номерам. На карте лежит только номер плитки (tile_id_dt, один байт на клетку),
+    а проходимость, прозрачность и графика берутся из таблиц этого реестра по номеру.
+    graphics[состояние, номер] - что рисовать: 0 - ШРАУД, 1 - dark, 2 - light."""
+
+    def __init__(self) -> None:
+        self.names: List[str] = []
+        self.tiles = numpy.empty(0, dtype=tile_dt)
+        self._update_tables()
+
+    def register(self, name: str, tile: numpy.ndarray) -> int:
+        if name in self.names:
+            raise ValueError(f"tile type {name!r} is already registered")
+        if len(self.names) > numpy.iinfo(tile_id_dt).max:
+            raise ValueError(f"at most {numpy.iinfo(tile_id_dt).max + 1} tile types fit in {tile_id_dt.name}")
+        self.names.append(name)
+        self.tiles = numpy.append(self.tiles, tile)
+        self._update_tables()
+        return len(self.names) - 1
+
+    def _update_tables(self) -> None:  #A таблицы лежат подряд в памяти, чтобы take по ним был быстрым
+        self.walkable = numpy.ascontiguousarray(self.tiles["walkable"])
+        self.transparent = numpy.ascontiguousarray(self.tiles["transparent"])
+        self.graphics = numpy.stack([numpy.full(len(self.tiles), SHROUD), self.tiles["dark"], self.tiles["light"]])
+
+    def planes(self, tile_ids: numpy.ndarray) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """Проходимость и прозрачность для массива номеров плиток, в порядке "F", как слои карты."""
+        return (
+            numpy.asfortranarray(self.walkable.take(tile_ids)),
+            numpy.asfortranarray(self.transparent.take(tile_ids)),
+        )
+
+    def render(self, tile_ids: numpy.ndarray, visible: numpy.ndarray, explored: numpy.ndarray) -> numpy.ndarray:
+        """Графика клеток одним take: видимые - light, исследованные - dark, остальные - ШРАУД."""
+        state = numpy.maximum(explored, visible.astype(numpy.intp) * 2)
+        state *= len(self.names)
+        state += tile_ids
+        return self.graphics.take(state)
+
+
+registry = TileRegistry()
+wall_id = registry.register("wall", wall)  #A стена идет первой: нулевой массив номеров - сплошная стена
+floor_id = registry.register("floor", floor)
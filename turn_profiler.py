@@ -0,0 +1,177 @@
+"""Встроенный профайлер ходов и кадров.
+
+Выключен по умолчанию. Включается переменной окружения ROGUELIKE_PROFILE (1 - отчет в stderr при выходе,
+любое другое значение - путь к файлу отчета) или флагом --profile у roguelike.py и action_log.py.
+Пока он выключен, phase() отдает один общий пустой контекст, а begin_turn/end_turn сразу возвращаются.
+
+Фазы: dispatch (разбор события), perform (действие игрока), enemy_turns, fov, render (GameMap.render), present.
+По каждой фазе, ходу и кадру хранятся последние WINDOW замеров (p50/p95/p99 считаются по ним) и прирост
+sys.getallocatedblocks() как грубая оценка выделений памяти; кроме того, запоминаются SLOWEST самых медленных ходов
+и время от запуска roguelike.py до первого кадра."""
+from __future__ import annotations
+
+import atexit
+import contextlib
+import heapq
+import os
+import sys
+import time
+from typing import Dict, List, Optional, TextIO, Tuple
+
+import numpy
+
+ENV_VAR = "ROGUELIKE_PROFILE"
+WINDOW = 4096
+SLOWEST = 10
+
+_NULL_PHASE = contextlib.nullcontext()
+
+
+class RollingStats:
+    """Последние WINDOW длительностей (в наносекундах) и сумма прироста выделенных блоков."""
+
+    __slots__ = ("samples", "count", "allocations")
+
+    def __init__(self, window: int = WINDOW):
+        self.samples = numpy.zeros(window, dtype=numpy.int64)
+        self.count = 0
+        self.allocations = 0
+
+    def add(self, elapsed: int, allocations: int) -> None:
+        self.samples[self.count % len(self.samples)] = elapsed
+        self.count += 1
+        self.allocations += allocations
+
+    def percentiles(self) -> Tuple[float, float, float, float]:  #  p50, p95, p99 и максимум в миллисекундах
+        samples = self.samples[:min(self.count, len(self.samples))] / 1e6
+        if samples.size == 0:
+            return 0.0, 0.0, 0.0, 0.0
+        p50, p95, p99 = numpy.percentile(samples, (50, 95, 99))
+        return float(p50), float(p95), float(p99), float(samples.max())
+
+
+class _Phase:
+    __slots__ = ("name", "profiler", "stats", "_start", "_blocks")
+
+    def __init__(self, name: str, profiler: TurnProfiler):
+        self.name = name
+        self.profiler = profiler
+        self.stats = RollingStats()
+
+    def __enter__(self) -> None:
+        self._blocks = sys.getallocatedblocks()
+        self._start = time.perf_counter_ns()
+
+    def __exit__(self, *exc: object) -> None:
+        elapsed = time.perf_counter_ns() - self._start
+        self.stats.add(elapsed, sys.getallocatedblocks() - self._blocks)
+        turn = self.profiler._turn_phases
+        if turn is not None:
+            turn[self.name] = turn.get(self.name, 0) + elapsed
+
+
+class TurnProfiler:
+    def __init__(self, enabled: bool = False, output: Optional[str] = None):
+        self.enabled = False
+        self.output = output
+        self.phases: Dict[str, _Phase] = {}
+        self.turns = RollingStats()
+        self.frames = RollingStats()
+        self.slowest: List[Tuple[int, int, int, Dict[str, int]]] = []  #  куча (длительность, номер хода, сущностей, фазы)
+        self._turn_phases: Optional[Dict[str, int]] = None
+        self._turn_start = 0
+        self._turn_blocks = 0
+        self._frame_start = 0
+        self._frame_blocks = 0
+        self.first_frame: Optional[float] = None  #  секунды от старта roguelike.py до первого показанного кадра
+        self._registered = False
+        if enabled:
+            self.enable(output)
+
+    @classmethod
+    def from_env(cls) -> TurnProfiler:
+        value = os.environ.get(ENV_VAR, "")
+        if not value or value == "0":
+            return cls()
+        return cls(enabled=True, output=None if value == "1" else value)
+
+    def enable(self, output: Optional[str] = None) -> None:
+        self.enabled = True
+        if output is not None:
+            self.output = output
+        if not self._registered:
+            atexit.register(self.dump)
+            self._registered = True
+
+    def phase(self, name: str) -> contextlib.AbstractContextManager:
+        if not self.enabled:
+            return _NULL_PHASE
+        phase = self.phases.get(name)
+        if phase is None:
+            phase = self.phases[name] = _Phase(name, self)
+        return phase
+
+    def begin_turn(self) -> None:
+        if not self.enabled:
+            return
+        self._turn_phases = {}
+        self._turn_blocks = sys.getallocatedblocks()
+        self._turn_start = time.perf_counter_ns()
+
+    def end_turn(self, entities: int) -> None:
+        if not self.enabled or self._turn_phases is None:
+            return
+        elapsed = time.perf_counter_ns() - self._turn_start
+        self.turns.add(elapsed, sys.getallocatedblocks() - self._turn_blocks)
+        record = (elapsed, self.turns.count, entities, self._turn_phases)
+        if len(self.slowest) < SLOWEST:
+            heapq.heappush(self.slowest, record)
+        elif elapsed > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, record)
+        self._turn_phases = None
+
+    def begin_frame(self) -> None:
+        if not self.enabled:
+            return
+        self._frame_blocks = sys.getallocatedblocks()
+        self._frame_start = time.perf_counter_ns()
+
+    def end_frame(self) -> None:
+        if not self.enabled:
+            return
+        self.frames.add(time.perf_counter_ns() - self._frame_start, sys.getallocatedblocks() - self._frame_blocks)
+
+    def mark_first_frame(self, seconds: float) -> None:
+        if self.enabled:
+            self.first_frame = seconds
+
+    def report(self, file: TextIO) -> None:
+        if self.first_frame is not None:
+            print(f"time to first frame: {self.first_frame * 1000:.1f} ms", file=file)
+        print(f"{'phase':<14}{'calls':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'blocks/call':>13}", file=file)
+        rows = [(name, phase.stats) for name, phase in self.phases.items()] + [("turn", self.turns), ("frame", self.frames)]
+        for name, stats in rows:
+            if not stats.count:
+                continue
+            p50, p95, p99, worst = stats.percentiles()
+            print(
+                f"{name:<14}{stats.count:>9}{p50:>10.3f}{p95:>10.3f}{p99:>10.3f}{worst:>10.3f}{stats.allocations / stats.count:>13.1f}",
+                file=file,
+            )
+        if self.slowest:
+            print(f"slowest {len(self.slowest)} turns:", file=file)
+            for elapsed, turn, entities, phases in sorted(self.slowest, reverse=True):
+                breakdown = " ".join(f"{name} {value / 1e6:.3f}" for name, value in phases.items())
+                print(f"  turn {turn:>6}  {elapsed / 1e6:8.3f} ms  entities {entities:>6}  {breakdown}", file=file)
+
+    def dump(self) -> None:  #  вызывается при выходе из процесса
+        if not self.enabled or not (self.turns.count or self.frames.count or self.first_frame is not None):
+            return
+        if self.output:
+            with open(self.output, "w") as file:
+                self.report(file)
+        else:
+            self.report(sys.stderr)
+
+
+profiler = TurnProfiler.from_env()  #  общий для процесса; Engine берет его себе в engine.profiler